@@ -5,6 +5,7 @@ from argparse import RawTextHelpFormatter
 import traceback
 import pprint
 import sys
+import os
 import os.path as osp
 
 # optional argcomplete support
@@ -13,7 +14,7 @@ try:
 except ImportError:
     argcomplete = False
 
-from modelmanager.settings import FunctionInfo
+from modelmanager.settings import FunctionInfo, SettingsManager
 from modelmanager.project import ProjectDoesNotExist
 
 
@@ -42,18 +43,23 @@ class CommandlineInterface(object):
         self.mainparser = argparse.ArgumentParser(**mpargs)
         self.mainparser.add_argument('-p', '--projectdir', metavar='<path>',
                                      help='The project directory')
+        self.mainparser.add_argument('--profile', action='store_true',
+                                     help='Print a startup profile of the '
+                                     'project to stderr')
         # extract project dir without firing parser
-        potpd = sys.argv[1] if len(sys.argv) > 1 else ''
-        if potpd.startswith('-p') or potpd.startswith('--projectdir'):
-            projectdir = potpd.split('=')[1] if '=' in potpd else sys.argv[2]
+        options, projectdir = self._main_options()
+        if projectdir is not None:
             msg = 'projectdir %s does not exist.' % projectdir
             assert osp.exists(projectdir), msg
         else:
             projectdir = '.'
+        profile = '--profile' in options
         try:
-            self.project = project(projectdir=projectdir)
+            self.project = self._load_project(project, projectdir, profile)
         except ProjectDoesNotExist:
             self.project = None
+        if profile and self.project:
+            print(self.project.settings.profile.report(), file=sys.stderr)
 
         if self.project:
             self.functions = {}
@@ -89,6 +95,40 @@ class CommandlineInterface(object):
             argcomplete.autocomplete(self.mainparser)
         return
 
+    @staticmethod
+    def _main_options():
+        """
+        Return the options given before the first command and the projectdir
+        (None if not given).
+        """
+        options, projectdir = [], None
+        args = iter(sys.argv[1:])
+        for a in args:
+            if not a.startswith('-'):
+                break
+            options.append(a)
+            if a in ('-p', '--projectdir'):
+                projectdir = next(args, None)
+            elif a.startswith('--projectdir=') or (a.startswith('-p') and
+                                                   not a.startswith('--')):
+                projectdir = a.split('=', 1)[1] if '=' in a else a[2:]
+        return options, projectdir
+
+    @staticmethod
+    def _load_project(project, projectdir, profile=False):
+        """Instantiate the project, with a startup profile if profile."""
+        envvar = SettingsManager.profile_environment_variable
+        previous = os.environ.get(envvar)
+        if profile:
+            os.environ[envvar] = '1'
+        try:
+            return project(projectdir=projectdir)
+        finally:
+            if profile and previous is None:
+                del os.environ[envvar]
+            elif profile:
+                os.environ[envvar] = previous
+
     def parse_args(self, argslist=None):
         """Parse arguments and convert vargs and kwargs.
 
@@ -5,11 +5,136 @@ import os
 import os.path as osp
 import errno
 import shutil
+import time
+import json
+import sqlite3
+import hashlib
+import warnings
+import threading
+import weakref
+import contextlib
+import functools
+import traceback
+import multiprocessing
+from multiprocessing.connection import wait as wait_connections
 from glob import glob
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+try:
+    import fcntl
+except ImportError:  # no process locks, e.g. on Windows
+    fcntl = None
 
 from modelmanager.project import ProjectDoesNotExist
 from modelmanager import utils
-from modelmanager.settings import parse_settings
+from modelmanager.settings import parse_settings, parsed_arguments
+from modelmanager.plugins.templates import _drop_spans
+
+# timing and error of a clone created by clone.many
+CloneReport = namedtuple('CloneReport', ['seconds', 'error'])
+# statistics of the CloneCache, see clone.cache_info
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize',
+                                     'memory', 'maxmemory', 'weakrefs'])
+
+
+class CloneCache(object):
+    """
+    Least recently used cache of the loaded clones of a project by name.
+
+    At most maxsize clones with an estimated memory (bytes) of maxmemory are
+    kept, evicted clones are kept as weak references, i.e. returned as long as
+    they are still referenced elsewhere.
+    """
+
+    def __init__(self, maxsize=128, maxmemory=None):
+        self.maxsize = maxsize
+        self.maxmemory = maxmemory
+        self._clones = OrderedDict()
+        self._memory = {}
+        self._weakrefs = weakref.WeakValueDictionary()
+        self._lock = threading.RLock()
+        self.hits = self.misses = 0
+        return
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._clones:
+                self._clones[key] = self._clones.pop(key)
+                self.hits += 1
+                return self._clones[key]
+            clone = self._weakrefs.get(key)
+            if clone is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+        self[key] = clone
+        return clone
+
+    def __setitem__(self, key, clone):
+        memory = clone_memory(clone)
+        with self._lock:
+            self.pop(key, None)
+            self._clones[key] = clone
+            self._memory[key] = memory
+            self._weakrefs[key] = clone
+            self.evict()
+        return
+
+    def evict(self):
+        """Evict least recently used clones beyond maxsize/maxmemory."""
+        with self._lock:
+            while len(self._clones) > 1 and (
+                    (self.maxsize is not None and
+                     len(self._clones) > self.maxsize) or
+                    (self.maxmemory is not None and
+                     sum(self._memory.values()) > self.maxmemory)):
+                evicted = next(iter(self._clones))
+                del self._clones[evicted]
+                del self._memory[evicted]
+        return
+
+    def __getitem__(self, key):
+        clone = self.get(key)
+        if clone is None:
+            raise KeyError(key)
+        return clone
+
+    def __contains__(self, key):
+        return key in self._clones or key in self._weakrefs
+
+    def __len__(self):
+        return len(self._clones)
+
+    def pop(self, key, *default):
+        with self._lock:
+            self._memory.pop(key, None)
+            clone = self._clones.pop(key, self._weakrefs.pop(key, None))
+        if clone is None:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        return clone
+
+    def clear(self):
+        with self._lock:
+            self._clones.clear()
+            self._memory.clear()
+            self._weakrefs.clear()
+        return
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize,
+                         len(self._clones), sum(self._memory.values()),
+                         self.maxmemory, len(self._weakrefs))
+
+
+def clone_memory(clone):
+    """Estimate the memory of a loaded clone by its attributes and cached
+    plugin instances."""
+    memory = sum(utils.memory_size(v) for k, v in clone.__dict__.items()
+                 if k not in ('settings', 'cloneparent'))
+    return memory + clone.settings.plugin_cache.total_memory
 
 
 class clone(object):
@@ -18,7 +143,18 @@ class clone(object):
     """
     plugin = ['__call__']
     default_resourcedir = 'clones'
-    loaded_clones = {}
+    # CloneCache by parent projectdir, see loaded_clones
+    clone_caches = {}
+    # CloneReport by name of the last clone.many/sync_many call
+    report = None
+    # Futures of background removals of the last clone.remove_many
+    removals = []
+    # file in the clone recording its copy rules and files, see sync
+    manifest_file = '.clone_manifest.json'
+    # arguments of __call__ that determine the files of a clone
+    rule_arguments = ('linked', 'links', 'ignore', 'mode')
+    # min. seconds between last_used index updates of a loaded clone
+    last_used_interval = 60
 
     def __init__(self, project):
         self.project = project
@@ -35,8 +171,31 @@ class clone(object):
             if exc.errno != errno.EEXIST:
                 raise
             pass
+        # configure the clone cache of the project (created on first use)
+        self.cache_limits = dict(
+            maxsize=getattr(project, 'clone_cache_maxsize', 128),
+            maxmemory=getattr(project, 'clone_cache_maxmemory', None))
+        cache = self.clone_caches.get(project.projectdir)
+        if cache is not None:
+            cache.maxsize = self.cache_limits['maxsize']
+            cache.maxmemory = self.cache_limits['maxmemory']
+            cache.evict()
         return
 
+    @property
+    def loaded_clones(self):
+        """
+        The CloneCache of the loaded clones of the project (shared by all
+        instances of the project in this process), limited by the
+        clone_cache_maxsize and clone_cache_maxmemory settings.
+        """
+        projectdir = self.project.projectdir
+        cache = self.clone_caches.get(projectdir)
+        if cache is None:
+            cache = self.clone_caches.setdefault(
+                projectdir, CloneCache(**self.cache_limits))
+        return cache
+
     def _get_path_by_name(self, name):
         path = osp.join(self.project.clone_dir, name)
         if not osp.exists(path):
@@ -44,30 +203,161 @@ class clone(object):
                                       % self.project.clone_dir)
         return path
 
+    @property
+    def index(self):
+        '''CloneIndex of the clones in the clone_dir.'''
+        return CloneIndex(self.project.clone_dir)
+
     def names(self, pattern='*'):
-        names = glob(osp.join(self.project.clone_dir, pattern))
-        namesdir = [osp.relpath(n, self.project.clone_dir)
-                    for n in sorted(names) if osp.isdir(n)]
-        return namesdir
+        '''
+        Names of the clones in the clone_dir matching the glob pattern.
+
+        Read from the clone index, built from the directories if it doesnt
+        exist. Use `rebuild_index` to include clones that were not created by
+        the clone plugin.
+        '''
+        return self.index.names(pattern)
+
+    def query(self, pattern='*', order_by='name', **conditions):
+        '''
+        Query clone metadata from the clone index.
+
+        Arguments:
+        ----------
+        pattern : str
+            Glob pattern of clone names.
+        order_by : str
+            Column to order by, e.g. 'last_used' or 'disk_usage DESC'.
+        conditions : <column>=value or <column>_before/_after/_min/_max=value
+            Filter by column values, e.g. created_before=time.time() - 3600,
+            mode='hardlink', disk_usage_min=1e9 or settings_hash=<hash>.
+
+        Returns
+        -------
+        list of dicts with name, created, last_used (unix time),
+        settings_hash (md5 of the parent settings), disk_usage (bytes of
+        copied files, 0 for symlink, hardlink and reflink clones, an upper
+        bound for auto) and mode. last_used is updated at most every
+        last_used_interval seconds while a clone is loaded.
+        '''
+        return self.index.query(pattern, order_by, **conditions)
+
+    def rebuild_index(self):
+        '''Recreate the clone index from the directories in the clone_dir.
+        '''
+        self.index.rebuild()
+        return
+
+    def remove_many(self, pattern='*', background=True):
+        '''
+        Remove all clones with names matching the glob pattern.
+
+        Arguments:
+        ----------
+        pattern : str
+            Glob pattern of clone names, see `names`.
+        background : bool
+            Move the clones into the trash directory of the clone_dir and
+            delete them in background threads (see `utils.remove_tree`).
+
+        Returns
+        -------
+        list of removed clone names (including those whose directory didnt
+        exist anymore), the concurrent.futures.Future of the background
+        removals are in `clone.removals`. Clones that can't be removed are
+        skipped with a warning.
+        '''
+        self.removals = []
+        removed, failed = [], []
+        try:
+            for name in self.names(pattern):
+                path = osp.join(self.project.clone_dir, name)
+                try:
+                    future = utils.remove_tree(path, background)
+                except OSError as err:
+                    if osp.exists(path):
+                        failed.append('%s: %s' % (name, err))
+                        continue
+                else:
+                    if future is not None:
+                        self.removals.append(future)
+                removed.append(name)
+                _uncache_clone(self.project.projectdir, name, path)
+        finally:
+            self.index.remove(*removed)
+        if failed:
+            warnings.warn('Could not remove %s clones:\n%s'
+                          % (len(failed), '\n'.join(failed)))
+        return removed
+
+    def empty_trash(self):
+        '''Delete remaining trashed clones (e.g. of interrupted processes).
+        '''
+        shutil.rmtree(osp.join(self.project.clone_dir, '.trash'), True)
+        return
+
+    def _index_clone(self, cprodir, files, rules, created=False):
+        values = dict(disk_usage=_disk_usage(files, rules['mode']),
+                      mode=rules['mode'],
+                      settings_hash=self._settings_hash())
+        index = CloneIndex(osp.dirname(cprodir))
+        name = osp.basename(cprodir)
+        if created:
+            values['created'] = values['last_used'] = time.time()
+            index.add(name, **values)
+        else:
+            index.update(name, **values)
+        return
+
+    def _settings_hash(self):
+        settings = self.project.settings
+        md5 = hashlib.md5(repr(sorted(settings.overrides.items())).encode())
+        if settings.file:
+            with open(settings.file, 'rb') as f:
+                md5.update(f.read())
+        return md5.hexdigest()
 
     def load_clone(self, name, **settings):
-        if name in self.loaded_clones:
-            return self.loaded_clones[name]
+        cache = self.clone_caches.get(self.project.projectdir)
+        clone = cache.get(name) if cache is not None else None
+        if clone is not None:
+            if time.time() - clone._last_used > self.last_used_interval:
+                self._update_last_used(name, clone)
+            return clone
         # clone settings (non-persistent)
         kwargs = {'cloned': True,
                   'cloneparent': self.project,
                   'clonename': name}
         settings.update(kwargs)
 
-        # dynamically inheriting project class
-        class ClonedProject(self.project.__class__, ClonedProjectMixin):
-            pass
+        ClonedProject = cloned_project_class(self.project.__class__)
         if 'projectdir' not in settings:
             settings['projectdir'] = self._get_path_by_name(name)
         clone = ClonedProject(**settings)
         self.loaded_clones[name] = clone
+        self._update_last_used(name, clone)
         return clone
 
+    def _update_last_used(self, name, clone):
+        clone._last_used = time.time()
+        try:
+            CloneIndex(osp.dirname(clone.projectdir)).update(
+                name, last_used=clone._last_used)
+        except sqlite3.Error as err:
+            warnings.warn('Could not update the clone index: %s' % err)
+        return
+
+    def cache_info(self):
+        '''
+        Statistics of the loaded clones cache of the project.
+
+        Returns
+        -------
+        CacheInfo(hits, misses, maxsize, currsize, memory, maxmemory,
+                  weakrefs) named tuple, memory in bytes (estimated).
+        '''
+        return self.loaded_clones.info()
+
     def __getitem__(self, key):
         """
         Load an existing clone.
@@ -76,7 +366,8 @@ class clone(object):
 
     @parse_settings
     def __call__(self, name, fresh=False, linked=True, verbose=False,
-                 dir=None, links=[], ignore=[], **settings):
+                 dir=None, links=[], ignore=[], mode='copy', copy_workers=1,
+                 **settings):
         '''
         Clone the project by creating a dir in project.clone_dir.
 
@@ -85,7 +376,8 @@ class clone(object):
         name : str
             Name of clone to create. If exists, return ClonedProject.
         fresh : bool
-            Remove existing clone of same name and recreate.
+            Remove existing clone of same name (in the background, warns if
+            that fails) and recreate.
         linked : bool
             Create symlink to project.resourcedir.
         verbose : bool
@@ -96,6 +388,12 @@ class clone(object):
             List of path patterns to create links to rather than copy.
         ignore : iterable
             List of path patterns to ignore when cloning.
+        mode : str
+            How files are copied: copy, symlink, hardlink, reflink or auto
+            (reflink if supported, otherwise copy), see `utils.copy_file`.
+            Templated files are unlinked before they are written.
+        copy_workers : int
+            Number of threads copying files concurrently (largest first).
         settings : <any keyword>
             Settings passed on to the clone project instance.
 
@@ -103,16 +401,62 @@ class clone(object):
         -------
         <clones.ClonedProject> instance
         '''
-        def printverbose(args):
-            if verbose:
-                print(args)
-            return
+        # new projectdir
+        cprodir = os.path.join(dir or self.resourcedir, name)
+        settings['projectdir'] = cprodir
+        # remove if fresh and already exists
+        if os.path.exists(cprodir):
+            if fresh:
+                if verbose:
+                    print('Removing %s' % cprodir)
+                # moved out of the way and deleted in the background
+                future = utils.remove_tree(cprodir, background=True)
+                future.add_done_callback(_warn_failed_removal)
+                _uncache_clone(self.project.projectdir, name, cprodir)
+            else:
+                print('Clone %s already exists, will try to load it.'
+                      % cprodir)
+                return self.load_clone(name, **settings)
+
+        # copy
+        rules = dict(linked=linked, links=links, ignore=ignore, mode=mode)
+        plan = self._resource_plan(verbose=verbose, **rules)
+        self._create(cprodir, plan, rules, verbose, copy_workers)
+
+        # return loaded project
+        return self.load_clone(name, **settings)
+
+    def _create(self, cprodir, plan, rules, verbose=False, workers=1):
+        """Copy the resource plan to cprodir and write the manifest."""
+        utils.apply_resource_plan(plan, cprodir, verbose=verbose,
+                                  mode=rules['mode'], workers=workers)
+        files = utils.resource_manifest(plan, cprodir)
+        self._write_manifest(cprodir, files, rules)
+        self._index_clone(cprodir, files, rules, created=True)
+        return
+
+    def _write_manifest(self, cprodir, files, rules):
+        with open(os.path.join(cprodir, self.manifest_file), 'w') as f:
+            json.dump({'rules': rules, 'files': files}, f)
+        return
+
+    def _read_manifest(self, cprodir):
+        """Return the rules and files of the clone manifest or None, {}."""
+        path = os.path.join(cprodir, self.manifest_file)
+        if not os.path.exists(path):
+            return None, {}
+        with open(path) as f:
+            manifest = json.load(f)
+        return manifest['rules'], manifest['files']
+
+    def _resource_plan(self, linked=True, links=[], ignore=[], verbose=False,
+                       **rules):
+        """Walk the project and evaluate the clone link and ignore rules."""
         pj = os.path.join
         prel = os.path.relpath
-        # project variables
         prodir = self.project.projectdir
-        clonesdir = dir or self.resourcedir  # checked in __init__
-
+        # never copy the manifest of a cloned project
+        ignore = ignore + [self.manifest_file]
         # link or ignore project.resourcedir
         resdir = prel(self.project.resourcedir, prodir)
         if linked:
@@ -123,33 +467,700 @@ class clone(object):
             if hasattr(self.project, 'browser'):
                 bdbpath = prel(self.project.browser.settings.dbpath, prodir)
                 ignore.append(bdbpath)
-        printverbose('Ignore rules: %r' % ignore)
-        printverbose('Link rules: %r' % links)
-        # new projectdir
-        cprodir = pj(clonesdir, name)
-        settings['projectdir'] = cprodir
-        # remove if fresh and already exists
-        if os.path.exists(cprodir):
-            if fresh:
-                printverbose('Removing %s' % cprodir)
-                shutil.rmtree(cprodir)
-            else:
-                print('Clone %s already exists, will try to load it.'
-                      % cprodir)
-                return self.load_clone(name, **settings)
+        if verbose:
+            print('Ignore rules: %r' % ignore)
+            print('Link rules: %r' % links)
+        return utils.resource_plan(prodir, ignore, links, verbose=verbose)
 
-        # copy
-        utils.copy_resources(prodir, cprodir, ignorepatterns=ignore,
-                             linkpatterns=links, verbose=verbose)
+    def _call_settings(self, **kwargs):
+        """Arguments of __call__ with the clone_<argument> settings parsed."""
+        return parsed_arguments(clone.__call__, self, **kwargs)
 
-        # return loaded project
-        return self.load_clone(name, **settings)
+    @parse_settings
+    def many(self, names, workers=None, **kwargs):
+        """
+        Create many clones concurrently.
 
+        The project is walked and the link/ignore rules are evaluated only once
+        for all clones, the files are copied in a thread pool and the clones
+        are loaded in the calling thread. Failing clones dont stop the others.
 
-class ClonedProjectMixin(object):
-    """Mix-in for ClonedProject dynamically inheriting in Clone.load_clone.
+        Arguments:
+        ----------
+        names : list of str
+            Names of the clones to create (or load if they exist).
+        workers : int
+            Number of copying threads (default: ThreadPoolExecutor default).
+        kwargs : <any keyword>
+            Arguments (fresh, linked, verbose, dir, links, ignore, mode,
+            copy_workers) and settings as in `clone()`, the clone_<argument>
+            settings apply.
+
+        Returns
+        -------
+        list of <clones.ClonedProject> instances in the order of names, None
+        for failed clones. The timing and error per clone are in
+        `clone.report`, an ordered dict of name: CloneReport(seconds, error).
+        """
+        kwargs = self._call_settings(**kwargs)
+        fresh, verbose = kwargs.pop('fresh'), kwargs.pop('verbose')
+        clonesdir = kwargs.pop('dir') or self.resourcedir
+        copy_workers = kwargs.pop('copy_workers')
+        rules = {k: kwargs.pop(k) for k in self.rule_arguments}
+        plan = self._resource_plan(verbose=verbose, **rules)
+
+        def create(name):
+            cprodir = os.path.join(clonesdir, name)
+            if os.path.exists(cprodir):
+                if not fresh:
+                    return
+                future = utils.remove_tree(cprodir, background=True)
+                future.add_done_callback(_warn_failed_removal)
+                _uncache_clone(self.project.projectdir, name, cprodir)
+            self._create(cprodir, plan, rules, verbose, copy_workers)
+            return
+
+        def load(name, result):
+            settings = dict(kwargs)
+            settings['projectdir'] = os.path.join(clonesdir, name)
+            return self.load_clone(name, **settings)
+        return self._batch(names, create, workers, load, 'create')
+
+    def sync(self, name, verbose=False, clean=False, **rules):
+        '''
+        Update an existing clone to its parent project.
+
+        Only files that changed in the parent or in the clone since the clone
+        was created or last synced are copied, files removed from the parent
+        are removed. The link, ignore and mode rules used to create the clone
+        are applied unless given. Files only in the clone (e.g. outputs) are
+        kept unless clean is True.
+
+        Arguments:
+        ----------
+        name : str
+            Name of the clone.
+        verbose : bool
+            Print actions.
+        clean : bool
+            Also remove files and directories that are not in the parent,
+            i.e. reset the clone to a freshly created one.
+        rules : linked, links, ignore, mode
+            Override the rules of the clone, see `clone()`.
+
+        Returns
+        -------
+        dict of copied, linked, created and removed relative paths.
+        '''
+        cprodir = self._get_path_by_name(name)
+        manifestrules, files = self._read_manifest(cprodir)
+        rules = self._sync_rules(manifestrules, rules)
+        plan = self._resource_plan(verbose=verbose, **rules)
+        return self._sync(cprodir, plan, files, rules, verbose, clean)
+
+    def _sync_rules(self, manifestrules, rules):
+        # rules of the manifest or settings, updated with rules
+        default = self._call_settings()
+        default = {k: default[k] for k in self.rule_arguments}
+        default.update(manifestrules or {})
+        default.update(rules)
+        return default
+
+    def _sync(self, cprodir, plan, files, rules, verbose=False, clean=False):
+        files, changes = utils.sync_resource_plan(
+            plan, cprodir, files, verbose=verbose, mode=rules['mode'],
+            clean=clean, keep=[self.manifest_file])
+        self._write_manifest(cprodir, files, rules)
+        self._index_clone(cprodir, files, rules)
+        return changes
+
+    @parse_settings
+    def sync_many(self, names=None, workers=None, verbose=False, clean=False,
+                  **rules):
+        '''
+        Sync many clones concurrently, see `sync`.
+
+        The project is walked only once for clones with the same rules.
+
+        Arguments:
+        ----------
+        names : list of str, optional
+            Names of the clones, default: all clones.
+        workers : int
+            Number of copying threads (default: ThreadPoolExecutor default).
+        verbose : bool
+            Print actions.
+        clean : bool
+            Also remove files and directories that are not in the parent.
+        rules : linked, links, ignore, mode
+            Override the rules of the clones, see `clone()`.
+
+        Returns
+        -------
+        list of sync changes in the order of names, None for failed clones.
+        The timing and error per clone are in `clone.report`.
+        '''
+        names = self.names() if names is None else names
+        # read manifests and walk the project in the calling thread
+        plans, jobs = {}, {}
+        for name in names:
+            try:
+                cprodir = self._get_path_by_name(name)
+                manifestrules, files = self._read_manifest(cprodir)
+            except Exception as exc:
+                jobs[name] = exc
+                continue
+            clonerules = self._sync_rules(manifestrules, rules)
+            key = json.dumps(clonerules, sort_keys=True)
+            if key not in plans:
+                plans[key] = self._resource_plan(verbose=verbose, **clonerules)
+            jobs[name] = (cprodir, plans[key], files, clonerules)
+
+        def sync(name):
+            if isinstance(jobs[name], Exception):
+                raise jobs[name]
+            cprodir, plan, files, clonerules = jobs[name]
+            return self._sync(cprodir, plan, files, clonerules, verbose,
+                              clean)
+        return self._batch(names, sync, workers, action='sync')
+
+    @parse_settings
+    def map(self, function, param_sets, processes=None, timeout=None,
+            retries=0, progress=None, errors='raise', prefix='map',
+            **kwargs):
+        '''
+        Call a project function in one clone per parameter set in parallel.
+
+        The clones named <prefix><number> are created (or loaded if they
+        exist) with `clone.many`. Each call runs in its own process so that it
+        can be stopped after timeout.
+
+        Arguments:
+        ----------
+        function : str or callable
+            Name of a project function or plugin method (e.g. 'run' or
+            'plugin.method') or a callable accepting the clone as argument.
+        param_sets : list of dict
+            Template values to write into each clone before the call. The
+            special key 'settings' may give a dict of settings to set.
+        processes : int
+            Number of processes (default: number of CPUs).
+        timeout : float
+            Seconds after which a call is stopped and fails.
+        retries : int
+            Number of times a failed or timed out call is repeated.
+        progress : callable
+            Called as progress(done, total) after each finished call.
+        errors : 'raise' | 'return'
+            Raise the first error after all calls finished or return the
+            exception instead of the result.
+        kwargs : <any keyword>
+            Arguments and settings passed to `clone.many`.
+
+        Returns
+        -------
+        list of return values in the order of param_sets.
+        '''
+        assert errors in ('raise', 'return'), "errors must be raise or return"
+        names = ['%s%04i' % (prefix, i) for i in range(len(param_sets))]
+        clones = self.many(names, **kwargs)
+        processes = processes or multiprocessing.cpu_count()
+        results = [None]*len(names)
+        attempts = [0]*len(names)
+        pending = [i for i, c in enumerate(clones) if c is not None]
+        failed = {i: self.report[n].error for i, n in enumerate(names)
+                  if clones[i] is None}
+        running = {}
+        done = len(failed)
+
+        def finish(i, error=None, result=None):
+            attempts[i] += 1
+            if error is not None and attempts[i] <= retries:
+                pending.append(i)
+                return 0
+            if error is not None:
+                failed[i] = error
+            results[i] = result
+            if progress:
+                progress(done + 1, len(names))
+            return 1
+
+        while pending or running:
+            while pending and len(running) < processes:
+                i = pending.pop(0)
+                receiver, sender = multiprocessing.Pipe(duplex=False)
+                proc = multiprocessing.Process(
+                    target=_map_task,
+                    args=(clones[i], function, param_sets[i], sender))
+                proc.start()
+                sender.close()
+                running[i] = (proc, receiver, time.time())
+            ready = wait_connections([r for _, r, _ in running.values()],
+                                     timeout=0.05)
+            for i, (proc, receiver, started) in list(running.items()):
+                if receiver in ready:
+                    try:
+                        status, value = receiver.recv()
+                    except EOFError:  # process died
+                        proc.join()
+                        status, value = 'error', RuntimeError(
+                            'Process of %s exited with code %s.'
+                            % (names[i], proc.exitcode))
+                elif timeout is not None and time.time()-started > timeout:
+                    proc.terminate()
+                    status, value = 'error', TimeoutError(
+                        '%s timed out after %ss.' % (names[i], timeout))
+                else:
+                    continue
+                proc.join()
+                receiver.close()
+                del running[i]
+                if status == 'ok':
+                    done += finish(i, result=value)
+                else:
+                    done += finish(i, error=value)
+        if failed and errors == 'raise':
+            raise failed[min(failed)]
+        for i, error in failed.items():
+            results[i] = error
+        return results
+
+    def pool(self, size, prefix='pool', **kwargs):
+        '''
+        Get a pool of clones that are reset to the parent after use.
+
+        The clones named <prefix><number> are created (or loaded) when the
+        pool is created. The pool may be used from several threads and (when
+        passed on/pickled to) processes on the same host:
+
+        ```
+        pool = project.clone.pool(8)
+        with pool.borrow() as clone:
+            clone.templates(alpha=0.5)
+            clone.run()
+        ```
+        Arguments:
+        ----------
+        size : int
+            Number of clones.
+        prefix : str
+            Prefix of the clone names.
+        kwargs : <any keyword>
+            Arguments and settings passed to `clone.many`.
+
+        Returns
+        -------
+        ClonePool instance
+        '''
+        return ClonePool(self.project, size, prefix, **kwargs)
+
+    def _batch(self, names, function, workers=None, finalise=None,
+               action='create'):
+        '''
+        Call function(name) in a thread pool and finalise(name, result) in
+        the calling thread, report timing and errors without stopping.
+        '''
+        def timed(name):
+            st = time.time()
+            result = function(name)
+            return result, time.time() - st
+
+        with ThreadPoolExecutor(workers) as pool:
+            futures = [(n, pool.submit(timed, n)) for n in names]
+            self.report = OrderedDict()
+            results = []
+            for name, future in futures:
+                seconds, error = 0, None
+                try:
+                    result, seconds = future.result()
+                    st = time.time()
+                    if finalise:
+                        result = finalise(name, result)
+                    seconds += time.time() - st
+                    results.append(result)
+                except Exception as exc:
+                    results.append(None)
+                    error = exc
+                    warnings.warn('Failed to %s clone %s: %r'
+                                  % (action, name, exc))
+                self.report[name] = CloneReport(seconds, error)
+        return results
+
+
+class CloneIndex(object):
+    '''
+    sqlite index of clone metadata in a clones directory, see clone.query.
+    '''
+    file_name = '.clone_index.sqlite'
+    columns = [('name', 'TEXT PRIMARY KEY'), ('created', 'REAL'),
+               ('last_used', 'REAL'), ('settings_hash', 'TEXT'),
+               ('disk_usage', 'INTEGER'), ('mode', 'TEXT')]
+    # seconds to wait for locks of other processes
+    timeout = 30
+
+    def __init__(self, clonesdir):
+        self.clonesdir = clonesdir
+        self.path = osp.join(clonesdir, self.file_name)
+        return
+
+    @contextlib.contextmanager
+    def _connect(self):
+        new = not osp.exists(self.path)
+        connection = sqlite3.connect(self.path, timeout=self.timeout)
+        try:
+            with connection:
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS clones (%s)'
+                    % ', '.join('%s %s' % c for c in self.columns))
+                # index existing clones before the first change
+                if new:
+                    self._insert(connection, self._scan())
+                yield connection
+        finally:
+            connection.close()
+
+    def _scan(self):
+        '''Index entries of the clone directories in the clones directory.'''
+        entries = []
+        for path in sorted(glob(osp.join(self.clonesdir, '*'))):
+            if not osp.isdir(path):
+                continue
+            rules, files = None, {}
+            # manifests may be missing or written by other processes
+            try:
+                with open(osp.join(path, clone.manifest_file)) as f:
+                    manifest = json.load(f)
+                rules, files = manifest['rules'], manifest['files']
+            except (IOError, OSError, ValueError, KeyError):
+                pass
+            mode = (rules or {}).get('mode')
+            created = os.stat(path).st_mtime
+            entries.append(dict(name=osp.basename(path), created=created,
+                                last_used=created,
+                                disk_usage=_disk_usage(files, mode),
+                                mode=mode))
+        return entries
+
+    def _insert(self, db, entries):
+        for values in entries:
+            columns = sorted(values)
+            db.execute('INSERT OR REPLACE INTO clones (%s) VALUES (%s)'
+                       % (', '.join(columns), ', '.join('?'*len(columns))),
+                       [values[c] for c in columns])
+        return
+
+    def _prune(self, db, names):
+        '''Remove and exclude names whose clone directory doesnt exist.'''
+        missing = [n for n in names
+                   if not osp.isdir(osp.join(self.clonesdir, n))]
+        if missing:
+            db.executemany('DELETE FROM clones WHERE name = ?',
+                           [(n,) for n in missing])
+        return missing
+
+    def rebuild(self):
+        '''Recreate the index from the directories in the clones directory.
+        '''
+        entries = self._scan()
+        with self._connect() as db:
+            db.execute('DELETE FROM clones')
+            self._insert(db, entries)
+        return
+
+    def _check_columns(self, names):
+        unknown = set(names) - set(c for c, _ in self.columns)
+        if unknown:
+            raise KeyError('Unknown clone index columns: %s' % unknown)
+        return
+
+    def add(self, name, **values):
+        '''Add or replace a clone.'''
+        values['name'] = name
+        self._check_columns(values)
+        with self._connect() as db:
+            self._insert(db, [values])
+        return
+
+    def update(self, name, **values):
+        '''Update columns of an indexed clone.'''
+        self._check_columns(values)
+        columns = sorted(values)
+        with self._connect() as db:
+            db.execute('UPDATE clones SET %s WHERE name = ?'
+                       % ', '.join('%s = ?' % c for c in columns),
+                       [values[c] for c in columns] + [name])
+        return
+
+    def remove(self, *names):
+        with self._connect() as db:
+            db.executemany('DELETE FROM clones WHERE name = ?',
+                           [(n,) for n in names])
+        return
+
+    def clear(self):
+        with self._connect() as db:
+            db.execute('DELETE FROM clones')
+        return
+
+    def names(self, pattern='*'):
+        with self._connect() as db:
+            rows = db.execute('SELECT name FROM clones WHERE name GLOB ? '
+                              'ORDER BY name', (pattern,)).fetchall()
+            names = [r[0] for r in rows]
+            missing = self._prune(db, names)
+        return [n for n in names if n not in missing]
+
+    def query(self, pattern='*', order_by='name', **conditions):
+        '''Query clones by name pattern and column conditions, see
+        clone.query.'''
+        operators = {'before': '<', 'after': '>', 'min': '>=', 'max': '<='}
+        where, values = ['name GLOB ?'], [pattern]
+        for k, v in sorted(conditions.items()):
+            column, _, suffix = k.rpartition('_')
+            if suffix not in operators:
+                column, suffix = k, None
+            self._check_columns([column])
+            where.append('%s %s ?' % (column, operators.get(suffix, '=')))
+            values.append(v)
+        order = order_by.split()
+        self._check_columns(order[:1])
+        assert order[1:] in ([], ['ASC'], ['DESC']), 'Invalid order_by.'
+        columns = [c for c, _ in self.columns]
+        with self._connect() as db:
+            rows = db.execute('SELECT %s FROM clones WHERE %s ORDER BY %s'
+                              % (', '.join(columns), ' AND '.join(where),
+                                 ' '.join(order)), values).fetchall()
+            missing = self._prune(db, [r[0] for r in rows])
+        return [dict(zip(columns, r)) for r in rows if r[0] not in missing]
+
+
+def _disk_usage(files, mode='copy'):
+    """Bytes of the copied files in a clone manifest.
+
+    Files of symlink, hardlink and reflink clones share their data with the
+    parent and count as 0 bytes.
     """
-    def remove(self):
-        """Remove the clone directory."""
-        shutil.rmtree(self.projectdir)
+    if mode in ('symlink', 'hardlink', 'reflink'):
+        return 0
+    return sum(e[3] for e in files.values() if type(e) is list)
+
+
+class ClonePool(object):
+    '''
+    Pool of clones that are reset to their parent project after use.
+
+    See `clone.pool`. A checked out clone is locked by a lock file in the
+    clone_dir (process-safe with fcntl) and marked as dirty, dirty clones are
+    reset with `clone.sync(clean=True)`, i.e. only files that differ from the
+    parent project are restored.
+    '''
+    # seconds to wait between trying to check out a clone
+    poll_interval = 0.05
+
+    def __init__(self, project, size, prefix='pool', **kwargs):
+        self.project = project
+        self.names = ['%s%03i' % (prefix, i) for i in range(size)]
+        # clone settings without clone arguments
+        arguments = list(project.clone._call_settings()) + ['workers']
+        self.settings = {k: v for k, v in kwargs.items()
+                         if k not in arguments}
+        self._lock = threading.Lock()
+        self._locks = {}
+        project.clone.many(self.names, **kwargs)
+        return
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_lock'] = None
+        state['_locks'] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        return
+
+    def _path(self, name, kind):
+        return os.path.join(self.project.clone_dir, '.%s.%s' % (name, kind))
+
+    def _acquire(self, name):
+        with self._lock:
+            if name in self._locks:
+                return False
+            self._locks[name] = None
+        if fcntl:
+            lockfile = open(self._path(name, 'lock'), 'a')
+            try:
+                fcntl.flock(lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                lockfile.close()
+                with self._lock:
+                    del self._locks[name]
+                return False
+            self._locks[name] = lockfile
+        return True
+
+    def _release(self, name):
+        with self._lock:
+            lockfile = self._locks.pop(name)
+        if lockfile:
+            lockfile.close()
         return
+
+    def checkout(self, timeout=None):
+        '''
+        Check out a clean clone, waiting for one to be checked in if all are
+        in use (raises a RuntimeError after timeout seconds).
+        '''
+        st = time.time()
+        while True:
+            for name in self.names:
+                if self._acquire(name):
+                    try:
+                        return self._checkout(name)
+                    except BaseException:
+                        self._release(name)
+                        raise
+            if timeout is not None and time.time() - st > timeout:
+                raise RuntimeError('No clone available in the pool after '
+                                   '%s seconds.' % timeout)
+            time.sleep(self.poll_interval)
+
+    def _checkout(self, name):
+        dirty = self._path(name, 'dirty')
+        if os.path.exists(dirty):
+            self.reset(name)
+        open(dirty, 'w').close()
+        return self.project.clone.load_clone(name, **self.settings)
+
+    def checkin(self, clone):
+        '''Reset the clone to the parent project and return it to the pool.
+        '''
+        name = clone.clonename
+        if name not in self._locks:
+            raise ValueError('Clone %s is not checked out.' % name)
+        try:
+            self.reset(name)
+            os.remove(self._path(name, 'dirty'))
+        finally:
+            self._release(name)
+        return
+
+    def reset(self, name):
+        '''Reset a clone to the parent project, returns the changes.'''
+        return self.project.clone.sync(name, clean=True)
+
+    @contextlib.contextmanager
+    def borrow(self, timeout=None):
+        '''Context of a checked out clone that is checked in on exit.'''
+        clone = self.checkout(timeout)
+        try:
+            yield clone
+        finally:
+            self.checkin(clone)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __repr__(self):
+        return '<ClonePool %s: %s clones>' % (self.project.clone_dir,
+                                             len(self))
+
+
+def _map_task(clone, function, parameters, connection):
+    """Process target of clone.map sending ('ok'|'error', value)."""
+    try:
+        parameters = dict(parameters)
+        settings = parameters.pop('settings', {})
+        if settings:
+            clone.settings(**settings)
+        if parameters:
+            clone.templates(**parameters)
+        if callable(function):
+            result = function(clone)
+        else:
+            result = functools.reduce(getattr, function.split('.'), clone)()
+        message = ('ok', result)
+    except BaseException as exc:
+        message = ('error', exc)
+    try:
+        connection.send(message)
+    except Exception:  # unpicklable result or exception
+        error = RuntimeError(''.join(traceback.format_exception_only(
+            type(message[1]), message[1])))
+        connection.send(('error', error))
+    connection.close()
+    return
+
+
+# ClonedProject classes by project class, see cloned_project_class
+_cloned_project_classes = {}
+
+
+def cloned_project_class(projectclass):
+    """
+    Return a ClonedProject class dynamically inheriting from projectclass.
+
+    The class is created only once per project class.
+    """
+    if issubclass(projectclass, ClonedProjectMixin):
+        return projectclass
+    if projectclass not in _cloned_project_classes:
+        class ClonedProject(projectclass, ClonedProjectMixin):
+            __reduce__ = ClonedProjectMixin.__reduce__
+        _cloned_project_classes[projectclass] = ClonedProject
+    return _cloned_project_classes[projectclass]
+
+
+class ClonedProjectMixin(object):
+    """Mix-in for ClonedProject dynamically inheriting in cloned_project_class.
+    """
+    # time of the last last_used update of the clone index, see load_clone
+    _last_used = 0
+
+    def __reduce__(self):
+        """Pickle the clone by reloading it from its (pickled) parent."""
+        settings = self.settings.rebuild_arguments()
+        for k in ('cloned', 'cloneparent', 'clonename'):
+            settings.pop(k, None)
+        settings['projectdir'] = self.projectdir
+        return (_rebuild_clone, (self.cloneparent, self.clonename, settings))
+
+    def remove(self, background=False):
+        """Remove the clone directory.
+
+        background: Move the directory into the trash of the clone_dir and
+        delete it in a background thread (see `utils.remove_tree`), returns a
+        Future.
+        """
+        future = utils.remove_tree(self.projectdir, background=background)
+        CloneIndex(osp.dirname(self.projectdir)).remove(self.clonename)
+        _uncache_clone(self.cloneparent.projectdir, self.clonename,
+                       self.projectdir)
+        return future
+
+
+def _warn_failed_removal(future):
+    """Warn if the background removal of a fresh clone's old tree failed."""
+    if not future.cancelled() and future.exception() is not None:
+        warnings.warn('Could not remove the old clone directory: %s'
+                      % future.exception())
+    return
+
+
+def _uncache_clone(parentdir, name, path):
+    """Drop a removed clone from its parent's cache, its own clone cache and
+    the template spans cache.
+    """
+    cache = clone.clone_caches.get(parentdir)
+    if cache is not None:
+        cache.pop(name, None)
+    clone.clone_caches.pop(osp.abspath(path), None)
+    _drop_spans(path)
+    return
+
+
+def _rebuild_clone(parent, name, settings):
+    """Reload a pickled clone from its parent project."""
+    plugin = getattr(parent, 'clone', None) or clone(parent)
+    return plugin.load_clone(name, **settings)
@@ -3,8 +3,17 @@ A plugin to read and write model (parameter) files based on a template system.
 """
 import os
 import os.path as osp
+import re
+import json
+import bisect
 import string
+import shutil
+import tempfile
 import warnings
+import threading
+import contextlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 from modelmanager import utils
 
@@ -38,9 +47,16 @@ class templates(object):
     {name:g} general numbers, float or int
     """
 
+    # field name index of the templates in the project resourcedir
+    index_file = '.templates_index.json'
+
     def __init__(self, project):
         self.project = project
         self.resourcedir = osp.join(project.resourcedir, 'templates')
+        self.index_path = osp.join(project.resourcedir, self.index_file)
+        self._index = None
+        # the open batch of each thread, see batch
+        self._local = threading.local()
 
         if not osp.exists(self.resourcedir):
             self._install()
@@ -78,6 +94,107 @@ class templates(object):
                 for path in matches]
         return tpts
 
+    def field_index(self):
+        """
+        Get the template paths (relative to the templates dir) by field name.
+
+        The index is persisted in the project resourcedir and only updated for
+        templates that changed (modification time or size) or if templates
+        were added or removed (modification time of their directory).
+        """
+        index = self._index
+        if index is None and osp.exists(self.index_path):
+            try:
+                with open(self.index_path) as f:
+                    index = json.load(f)
+            except ValueError:  # corrupt/incomplete
+                index = None
+        if index is None or not self._index_valid(index):
+            index = self._build_index(index)
+        self._index = index
+        return index['fields']
+
+    def _index_valid(self, index):
+        try:
+            for d, mtime in index['dirs'].items():
+                if os.stat(osp.join(self.resourcedir, d)).st_mtime != mtime:
+                    return False
+            for t, (mtime, size, _) in index['templates'].items():
+                st = os.stat(osp.join(self.resourcedir, t))
+                if (st.st_mtime, st.st_size) != (mtime, size):
+                    return False
+        except OSError:
+            return False
+        return True
+
+    def _build_index(self, previous=None):
+        previous = previous['templates'] if previous else {}
+        dirs, tmplts, fields = {}, {}, {}
+        for path, _, files in os.walk(self.resourcedir):
+            dirs[osp.relpath(path, self.resourcedir)] = os.stat(path).st_mtime
+            for f in sorted(files):
+                tpath = osp.join(path, f)
+                rpath = osp.relpath(tpath, self.resourcedir)
+                st = os.stat(tpath)
+                entry = previous.get(rpath)
+                if not entry or entry[:2] != [st.st_mtime, st.st_size]:
+                    names = template_info(tpath).fields
+                    entry = [st.st_mtime, st.st_size, sorted(n for n in names
+                                                             if n)]
+                tmplts[rpath] = entry
+                for n in entry[2]:
+                    fields.setdefault(n, []).append(rpath)
+        index = {'dirs': dirs, 'templates': tmplts, 'fields': fields}
+        # write atomically as other processes may read it
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.project.resourcedir)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(index, f)
+            os.replace(tmp, self.index_path)
+        except (IOError, OSError) as err:
+            warnings.warn('Could not write the templates index: %s' % err)
+        return index
+
+    @property
+    def _batch(self):
+        return getattr(self._local, 'batch', None)
+
+    @_batch.setter
+    def _batch(self, batch):
+        self._local.batch = batch
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Context in which template values are read and set in memory and
+        written once per file on exit (atomically via a temporary file).
+
+        Nothing is written if an error (e.g. an unknown value) occurs.
+        ```
+        with project.templates.batch():
+            project.templates(a=1, b=2)
+            project.params['c'] = 3
+        ```
+        Nested batches are part of the outermost batch, batches are opened
+        per thread and committed one at a time.
+        """
+        if self._batch is not None:
+            yield self._batch
+            return
+        self._batch = TemplatesBatch()
+        try:
+            yield self._batch
+            self._batch.commit()
+        finally:
+            self._batch = None
+        return
+
+    def read_values(self, template):
+        """Read all values of a Template (staged values in a batch)."""
+        if self._batch is not None:
+            return self._batch.read_values(template)
+        return template.read_values()
+
     def __call__(self, *getvalues, **setvalues):
         """
         Global value getter and setter.
@@ -88,22 +205,99 @@ class templates(object):
                    returned.
         Special keyword:
         templates: Template part or pattern str / list of str to subset get/set
-                   otherwise use all available templates
+                   otherwise use all templates with the values (see
+                   field_index)
         """
         gotvalues = {}
         setvals = {}
-        # get tempates
-        if 'templates' in setvalues:
-            tmpltarg = setvalues.pop('templates')
-            tmpltarg = [tmpltarg] if type(tmpltarg) is str else tmpltarg
-            templates = [self.get_template(pp) for pp in tmpltarg]
-        else:
-            templates = self.get_templates()
+        templates = self._select_templates(getvalues + tuple(setvalues),
+                                           setvalues.pop('templates', None))
         assert len(getvalues) > 0 or len(setvalues) > 0, (
                "No values to get or set.")
+        with self.batch():
+            self._get_set(templates, getvalues, setvalues, gotvalues, setvals)
+        if getvalues:
+            result = [v for v in getvalues if v not in gotvalues]
+            if len(result) > 0:
+                raise KeyError('Could not find values for %s' % result)
+            ret = tuple([gotvalues.pop(v) for v in getvalues])
+            return ret if len(ret) > 1 else ret[0]
+        return
+
+    def _select_templates(self, fields, patterns=None):
+        """Templates matching patterns or containing any of fields."""
+        if patterns is not None:
+            patterns = [patterns] if type(patterns) is str else patterns
+            return [self.get_template(pp) for pp in patterns]
+        index = self.field_index()
+        paths = set(p for v in fields for p in index.get(v, []))
+        return [Template(osp.join(self.resourcedir, p),
+                         osp.join(self.project.projectdir, p))
+                for p in sorted(paths)]
+
+    def render(self, parameters, destinations, workers=None, templates=None):
+        """
+        Write parameter sets into the templated files of other project
+        directories (e.g. of clones), one set per directory.
+
+        Each templated file of this project is parsed once and the values
+        of each set are patched into its text (see Template.spans).
+
+        Arguments:
+        ----------
+        parameters : pandas.DataFrame | list of dicts
+            Parameter sets (rows) of template values (columns).
+        destinations : list of str
+            Project directories in the order of the parameter sets.
+        workers : int
+            Number of writing threads (default: ThreadPoolExecutor default).
+        templates : str | list of str
+            Template part or pattern (see get_template) to render instead of
+            all templates with the values (see field_index).
+
+        Returns
+        -------
+        list of written file paths per destination.
+        """
+        if hasattr(parameters, 'to_dict'):
+            parameters = parameters.to_dict('records')
+        parameters = [dict(p) for p in parameters]
+        assert len(parameters) == len(destinations), (
+               "Need as many destinations as parameter sets.")
+        fields = set(k for p in parameters for k in p)
+        tmplts = self._select_templates(sorted(fields), templates)
+        spans = [t.spans for t in tmplts]
+        notfound = fields - set(k for s in spans for k in s.values)
+        if notfound:
+            raise KeyError('Could not find values for %s' % sorted(notfound))
+
+        def write(values, destination):
+            written = []
+            for tmplt, sp in zip(tmplts, spans):
+                tvals = {k: v for k, v in values.items() if k in sp.values}
+                patches = sp.patches(tvals)
+                newline = None if patches is None else ''
+                if patches is None:
+                    content = tmplt.template.format(**dict(sp.values, **tvals))
+                else:
+                    content = sp.patched(sp.edits(patches))
+                relpath = osp.relpath(tmplt.filepath, self.project.projectdir)
+                path = osp.join(destination, relpath)
+                if not osp.exists(osp.dirname(path)):
+                    os.makedirs(osp.dirname(path))
+                # dont write into linked files (e.g. of clones)
+                utils.break_link(path)
+                with open(path, 'w', newline=newline) as f:
+                    f.write(content)
+                written.append(path)
+            return written
+        with ThreadPoolExecutor(workers) as pool:
+            return list(pool.map(write, parameters, destinations))
+
+    def _get_set(self, templates, getvalues, setvalues, gotvalues, setvals):
         # get and set
         for t in templates:
-            values = t.read_values()
+            values = self.read_values(t)
             for gv in getvalues:
                 if gv in values:
                     # warn if value already found and differing
@@ -116,23 +310,183 @@ class templates(object):
             valset = {k: v for k, v in setvalues.items() if k in values}
             setvals.update(valset)
             if valset:
-                t.write_values(**valset)
-        # ensure everything asked for was completed
+                self._batch.write_values(t, **valset)
+        # ensure everything asked for was completed (rolls back the batch)
         if setvalues and not setvals == setvalues:
             notset = {k: v for k, v in setvalues.items() if not (k in setvals)}
             raise KeyError('Could not set all values: %s' % notset)
-        if getvalues:
-            result = [v for v in getvalues if v not in gotvalues]
-            if len(result) > 0:
-                raise KeyError('Could not find values for %s' % result)
-            ret = tuple([gotvalues.pop(v) for v in getvalues])
-            return ret if len(ret) > 1 else ret[0]
         return
 
     def __getitem__(self, pathorpart):
         return self.get_template(pathorpart)
 
 
+# (modification time, size), TemplateInfo by template path, see template_info
+_template_cache = {}
+# FieldSpans by templated file path, least recently used evicted beyond
+# SPANS_CACHE_MAXMEMORY (bytes of file text), see Template.spans
+_spans_cache = utils.PluginCache()
+SPANS_CACHE_MAXMEMORY = 64 * 2**20
+# serialises writes of templated files (batch commits, write_values)
+_write_lock = threading.RLock()
+
+
+class TemplateInfo(object):
+    """
+    The content, whitespace-normalised and compiled parser of a template file.
+    """
+
+    def __init__(self, template):
+        self.template = template
+        self.normalised = ' '.join(template.split())
+        self.parser = parse.compile(self.normalised)
+        flds = list(string.Formatter().parse(template))
+        self.fields = {name: (lit, spec, conv)
+                       for lit, name, spec, conv in flds}
+        names = [name for _, name, _, _ in flds if name is not None]
+        self.repeated = set(n for n in names if names.count(n) > 1)
+        self._field_parsers = {}
+        return
+
+    def format_field(self, name, value):
+        """Format a single value as in the template."""
+        _, spec, conv = self.fields[name]
+        fmt = '{0%s%s}' % ('!' + conv if conv else '',
+                           ':' + spec if spec else '')
+        return fmt.format(value)
+
+    def parse_field(self, name, text):
+        """Parse the text of a single value, return None if it doesnt match."""
+        if name not in self._field_parsers:
+            spec = self.fields[name][1]
+            fmt = '{%s%s}' % (name, ':' + spec if spec else '')
+            self._field_parsers[name] = parse.compile(fmt)
+        result = self._field_parsers[name].parse(text)
+        return None if result is None else result.named[name]
+
+
+def template_info(templatepath):
+    """
+    Get the TemplateInfo of a template file, cached until the file changes
+    (modification time or size).
+    """
+    stat = os.stat(templatepath)
+    signature = (stat.st_mtime, stat.st_size)
+    cached = _template_cache.get(templatepath)
+    if cached is None or cached[0] != signature:
+        with open(templatepath) as f:
+            cached = signature, TemplateInfo(f.read())
+        _template_cache[templatepath] = cached
+    return cached[1]
+
+
+def file_signature(path):
+    """Modification time, size and inode of a file."""
+    st = os.stat(path)
+    return st.st_mtime, st.st_size, st.st_ino
+
+
+def _drop_spans(directory):
+    """Remove the cached FieldSpans of the files in directory (recursively).
+    """
+    prefix = osp.join(osp.abspath(directory), '')
+    with _write_lock:
+        for path in list(_spans_cache):
+            if osp.abspath(path).startswith(prefix):
+                _spans_cache.pop(path)
+    return
+
+
+class FieldSpans(object):
+    """
+    The values of a templated file and the character offsets (spans) of their
+    text in the file, used to patch values without reformatting the file.
+
+    Spans are None for values that can't be located unambiguously.
+    """
+
+    def __init__(self, info, text, result, signature=None):
+        self.info = info
+        self.text = text
+        self.values = result.named
+        self.signature = signature
+        # only patch files in place whose character and byte offsets match
+        # (text is read without newline translation)
+        try:
+            text.encode('ascii')
+            self.inplace = True
+        except UnicodeError:
+            self.inplace = False
+        # map offsets in the whitespace-normalised text to the file text
+        words = [m.span() for m in re.finditer(r'\S+', text)]
+        starts, n = [], 0
+        for s, e in words:
+            starts.append(n)
+            n += e - s + 1
+
+        def offset(i, end=False):
+            w = bisect.bisect_right(starts, i - 1 if end else i) - 1
+            if w < 0:
+                return None
+            s, e = words[w]
+            o = s + i - starts[w]
+            return o if (s < o <= e if end else s <= o < e) else None
+        self.spans = {}
+        for name, (ns, ne) in result.spans.items():
+            if name in info.repeated or ns >= ne:
+                self.spans[name] = None
+                continue
+            span = offset(ns), offset(ne, end=True)
+            self.spans[name] = None if None in span else span
+        return
+
+    def patches(self, values):
+        """
+        Format values to {name: (text, value)} or return None if a value
+        can't be patched (unknown span, whitespace or type mismatch).
+        """
+        patches = {}
+        for name, value in values.items():
+            if self.spans.get(name) is None:
+                return None
+            text = self.info.format_field(name, value)
+            if text.split() != [text]:
+                return None
+            parsed = self.info.parse_field(name, text)
+            if parsed is None:
+                return None
+            patches[name] = (text, parsed)
+        return patches
+
+    def edits(self, patches):
+        """Sorted (start, end, text) of the patches in the current text."""
+        return sorted(self.spans[n] + (t,) for n, (t, _) in patches.items())
+
+    def patched(self, edits):
+        """Return the text with the edits applied."""
+        pieces, pos = [], 0
+        for s, e, t in edits:
+            pieces.extend([self.text[pos:s], t])
+            pos = e
+        pieces.append(self.text[pos:])
+        return ''.join(pieces)
+
+    def apply(self, patches):
+        """Patch the text, values and spans, return the edits."""
+        edits = self.edits(patches)
+        self.text = self.patched(edits)
+        for name, span in self.spans.items():
+            if span is None:
+                continue
+            shift = sum(len(t) - (e - s) for s, e, t in edits if s < span[0])
+            end = span[0] + len(patches[name][0]) if name in patches else (
+                  span[1])
+            self.spans[name] = (span[0] + shift, end + shift)
+        for name, (_, value) in patches.items():
+            self.values[name] = value
+        return edits
+
+
 class Template(object):
     """
     A representation of a template and file pair with associated functionality.
@@ -154,9 +508,7 @@ class Template(object):
         """
         Read a template file into a string.
         """
-        with open(self.templatepath) as f:
-            tmpstr = f.read()
-        return tmpstr
+        return template_info(self.templatepath).template
 
     @property
     def file(self):
@@ -166,21 +518,33 @@ class Template(object):
 
     @property
     def fields(self):
-        flds = string.Formatter().parse(self.template)
-        return {name: (lit, spec, conv) for lit, name, spec, conv in flds}
+        return dict(template_info(self.templatepath).fields)
 
-    def __repr__(self):
-        return '<Template %s / %s>' % (self.templatepath, self.filepath)
-
-    def read_values(self, *templatefields):
+    @property
+    def spans(self):
         """
-        Read the values of template into a dictionary.
+        The FieldSpans of the templated file, parsed once until the file or
+        template change.
         """
+        # not while the file is written (see write_values)
+        with _write_lock:
+            return self._parse_spans()
+
+    def _parse_spans(self):
+        info = template_info(self.templatepath)
+        signature = file_signature(self.filepath)
+        spans = _spans_cache.get(self.filepath)
+        if spans and spans.info is info and spans.signature == signature:
+            return spans
+        # offsets in the untranslated content (e.g. with \r\n newlines)
+        with open(self.filepath, newline='') as f:
+            text = f.read()
         # parse with cleaned whitespace
-        tw, fw = self.template.split(), self.file.split()
-        result = parse.parse(' '.join(tw), ' '.join(fw))
+        fw = text.split()
+        result = info.parser.parse(' '.join(fw))
         # unsucessful parsing
         if result is None:
+            tw = info.template.split()
             nw = min(len(tw), len(fw))
             worddiff = [tw[i] + ': ' + fw[i] for i in range(nw)
                         if (tw[i] != fw[i] and not parse.parse(tw[i], fw[i]))]
@@ -190,34 +554,149 @@ class Template(object):
                      'non-whitespace strings and field types must stricly '
                      'match with those in the template.')
             raise ValueError(ermsg)
+        spans = FieldSpans(info, text, result, signature)
+        _spans_cache.put(self.filepath, spans, len(text),
+                         SPANS_CACHE_MAXMEMORY)
+        return spans
+
+    def __repr__(self):
+        return '<Template %s / %s>' % (self.templatepath, self.filepath)
+
+    def read_values(self, *templatefields):
+        """
+        Read the values of template into a dictionary.
+        """
+        values = self.spans.values
         # return dict subset
         if len(templatefields) > 0:
             res = {}
             for f in templatefields:
-                if f not in result.named:
+                if f not in values:
                     raise KeyError(self.field_not_found_error_msg % f)
-                res[f] = result.named[f]
+                res[f] = values[f]
             # return value only
             if len(res) == 1:
                 return res[list(res.keys())[0]]
         # return all
         else:
-            res = result.named
+            res = dict(values)
         return res
 
     def write_values(self, **templatevalues):
         """
         Write any number of template values into a templated file.
+
+        The text of the values is patched in place (only the changed bytes
+        are written if the lengths match) if they can be located in the file
+        (see spans), otherwise the whole template is formatted.
         """
         assert len(templatevalues) > 0, "No values to write."
-        values = self.read_values()
-        for k, v in templatevalues.items():
-            if k not in values:
-                raise KeyError(self.field_not_found_error_msg % k)
-            values[k] = v
-        formatted = self.template.format(**values)
-        with open(self.filepath, 'w') as f:
-            f.write(formatted)
+        with _write_lock:
+            spans = self.spans
+            for k in templatevalues:
+                if k not in spans.values:
+                    raise KeyError(self.field_not_found_error_msg % k)
+            patches = spans.patches(templatevalues)
+            # dont write into the file of the project this one is linked to
+            utils.break_link(self.filepath)
+            if patches is None:
+                values = dict(spans.values, **templatevalues)
+                _spans_cache.pop(self.filepath, None)
+                with open(self.filepath, 'w') as f:
+                    f.write(self.template.format(**values))
+                return
+            edits = spans.apply(patches)
+            if spans.inplace and all(len(t) == e - s for s, e, t in edits):
+                with open(self.filepath, 'rb+') as f:
+                    for s, e, t in edits:
+                        f.seek(s)
+                        f.write(t.encode('ascii'))
+            else:
+                with open(self.filepath, 'w', newline='') as f:
+                    f.write(spans.text)
+            spans.signature = file_signature(self.filepath)
+        return
+
+
+class TemplatesBatch(object):
+    """
+    Values of templates staged in memory and written on commit, see
+    templates.batch.
+    """
+
+    def __init__(self):
+        # [Template, values, changed value names] by templated file path
+        self.staged = OrderedDict()
+        return
+
+    def _entry(self, template):
+        if template.filepath not in self.staged:
+            self.staged[template.filepath] = [template,
+                                              template.read_values(), set()]
+        return self.staged[template.filepath]
+
+    def read_values(self, template):
+        return dict(self._entry(template)[1])
+
+    def write_values(self, template, **templatevalues):
+        entry = self._entry(template)
+        for k in templatevalues:
+            if k not in entry[1]:
+                raise KeyError(template.field_not_found_error_msg % k)
+        entry[1].update(templatevalues)
+        entry[2].update(templatevalues)
+        return
+
+    def commit(self):
+        """
+        Write all changed files. A single file is patched in place (see
+        Template.write_values), several files are first written to temporary
+        files and then renamed.
+        """
+        changed = [(t, {k: values[k] for k in c})
+                   for t, values, c in self.staged.values() if c]
+        with _write_lock:
+            if len(changed) == 1:
+                changed[0][0].write_values(**changed[0][1])
+            elif changed:
+                self._replace(changed)
+        self.staged.clear()
+        return
+
+    def _replace(self, changed):
+        # (tmp path, path, spans, patches) of each changed file
+        tmpfiles = []
+        try:
+            for template, values in changed:
+                spans = template.spans
+                patches = spans.patches(values)
+                if patches is None:
+                    values = dict(spans.values, **values)
+                    content = template.template.format(**values)
+                else:
+                    content = spans.patched(spans.edits(patches))
+                path = template.filepath
+                dirname, name = osp.split(osp.abspath(path))
+                fd, tmp = tempfile.mkstemp(prefix='.' + name, dir=dirname)
+                tmpfiles.append((tmp, path, spans, patches))
+                newline = None if patches is None else ''
+                with os.fdopen(fd, 'w', newline=newline) as f:
+                    f.write(content)
+                shutil.copymode(path, tmp)
+            # replacing also unlinks symlinked/hard linked files
+            while tmpfiles:
+                tmp, path, spans, patches = tmpfiles[0]
+                os.replace(tmp, path)
+                tmpfiles.pop(0)
+                # keep the parsed spans of the new file
+                if patches is None:
+                    _spans_cache.pop(path, None)
+                else:
+                    spans.apply(patches)
+                    spans.signature = file_signature(path)
+        finally:
+            for tmp, _, _, _ in tmpfiles:
+                os.remove(tmp)
         return
 
 
@@ -254,11 +733,14 @@ class TemplatesDict(dict):
 
     def update(self, *args, **kwargs):
         setdict = dict(*args, **kwargs)
-        if setdict:
-            self.project.templates(templates=self.template_patterns, **setdict)
-        for tplt in self.templates:
-            for k, v in tplt.read_values().items():
-                dict.__setitem__(self, k, v)
+        with self.project.templates.batch():
+            if setdict:
+                self.project.templates(templates=self.template_patterns,
+                                       **setdict)
+            for tplt in self.templates:
+                values = self.project.templates.read_values(tplt)
+                for k, v in values.items():
+                    dict.__setitem__(self, k, v)
         return
 
     def __repr__(self):
@@ -13,7 +13,9 @@ from os import path as osp
 import shutil
 import sys
 
-from modelmanager.settings import SettingsManager, SettingsUndefinedError
+from modelmanager.settings import (SettingsManager, SettingsUndefinedError,
+                                   PropertyDispatcher,
+                                   write_resourcedir_marker)
 
 
 class Project(object):
@@ -23,12 +25,24 @@ class Project(object):
     state.
     """
 
-    def __init__(self, projectdir='.', **settings):
+    def __init__(self, projectdir='.', _profile=False, **settings):
+        """
+        Arguments
+        ---------
+        projectdir : str path
+            The project directory.
+        _profile : bool
+            Record a startup profile in ``self.settings.profile`` (underscored
+            to not clash with a setting named profile).
+        **settings :
+            Settings overriding those in the settings file.
+        """
         self.projectdir = osp.abspath(projectdir)
         # initalise settings
-        self.settings = SettingsManager(self)
+        self.settings = SettingsManager(self, profile=_profile)
         # load settings with overridden settings
         self.settings.load(**settings)
+        self.settings.profile.stop()
         return
 
     def __repr__(self):
@@ -36,24 +50,57 @@ class Project(object):
         r = ('<%s instance in: %s >' % (self.__class__.__name__, rpd))
         return r
 
+    def __reduce__(self):
+        """
+        Pickle the project by rebuilding it from its projectdir and overridden
+        settings, e.g. to send it to a process pool.
+        """
+        return (_rebuild_project, (self.__class__, self.projectdir,
+                                   self.settings.rebuild_arguments()))
+
     def __getattr__(self, attr):
         """
-        Fall-back if requested setting isnt defined.
+        Dispatch properties assigned through the settings or fall-back if
+        requested setting isnt defined.
+
+        Settings properties are kept per project instance in
+        ``self.settings.properties`` rather than on the class, so that
+        projects in the same process dont share/overwrite them (usually
+        dispatched by a settings.PropertyDispatcher before getting here).
         """
+        settings = self.__dict__.get('settings')
+        prop = settings.properties.get(attr) if settings is not None else None
+        if prop is not None:
+            try:
+                return prop.__get__(self, self.__class__)
+            except AttributeError:
+                self._raise_property_error(attr)
         # make sure AttributeErrors from properties are not misinterpreted
-        if attr in self.__class__.__dict__:
+        classattr = self.__class__.__dict__.get(attr)
+        # dispatchers of properties of other projects (or their class attr)
+        if isinstance(classattr, PropertyDispatcher):
+            classattr = classattr.shadowed
+        if isinstance(classattr, property):
             try:
                 # acess property without getattr
-                self.__class__.__dict__[attr].fget(self)
+                return classattr.fget(self)
             except AttributeError:
-                import traceback
-                ex_type, ex, tb = sys.exc_info()
-                raise AttributeError('While accessing the setting %s,' % attr +
-                                     ' the below error occurred:\n\n' +
-                                     ''.join(traceback.format_tb(tb)) +
-                                     'AttributeError: '+str(ex))
-        else:
-            raise SettingsUndefinedError(attr)
+                self._raise_property_error(attr)
+        raise SettingsUndefinedError(attr)
+
+    @staticmethod
+    def _raise_property_error(attr):
+        import traceback
+        ex_type, ex, tb = sys.exc_info()
+        raise AttributeError('While accessing the setting %s,' % attr +
+                             ' the below error occurred:\n\n' +
+                             ''.join(traceback.format_tb(tb)) +
+                             'AttributeError: '+str(ex))
+
+
+def _rebuild_project(cls, projectdir, settings):
+    """Reinstantiate a pickled project."""
+    return cls(projectdir, **settings)
 
 
 def setup(projectdir='.', resourcedir='mm'):
@@ -73,6 +120,8 @@ def setup(projectdir='.', resourcedir='mm'):
 
     default_resources = osp.join(osp.dirname(__file__), 'resources')
     shutil.copytree(default_resources, resourcedir)
+    # record resourcedir to avoid searching for it
+    write_resourcedir_marker(projectdir, resourcedir)
 
     # load project and update/create database
     pro = Project(projectdir)
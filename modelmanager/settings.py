@@ -5,6 +5,7 @@ management and validation of the project settings defined in the settings
 '''
 
 import sys
+import os
 import json
 import os.path as osp
 from glob import glob
@@ -13,6 +14,8 @@ import types
 import traceback
 import re
 import functools
+import hashlib
+import copy
 
 from modelmanager import utils
 
@@ -20,12 +23,33 @@ from modelmanager import utils
 class SettingsManager(object):
     '''
     Object to manage everything defined in the settings file.
+
+    Special settings
+    ----------------
+    lazy_plugins : bool
+        Attach settings classes as ``LazyPlugin`` proxies that only
+        instantiate the plugin on first use (default: False).
+    plugin_cache_maxmemory : int
+        Memory budget (bytes) of the cached plugin instances of
+        ``utils.cachedpropertyplugin`` (default: None, unlimited).
+
+    Profiling
+    ---------
+    If profile=True or the environment variable MODELMANAGER_PROFILE is set
+    (and not 0), wall time and peak memory of the settings file discovery and
+    execution, each plugin instantiation and registration are recorded in
+    ``self.profile`` (a ``utils.PhaseProfiler``, see ``profile.phases`` and
+    ``print(profile.report())``).
     '''
 
     settings_file_name = 'settings.py'
+    profile_environment_variable = 'MODELMANAGER_PROFILE'
 
-    def __init__(self, project):
+    def __init__(self, project, profile=False):
         self._project = project
+        envprof = os.environ.get(self.profile_environment_variable, '0')
+        self.profile = utils.PhaseProfiler(
+            enabled=profile or envprof not in ('', '0'))
         # attributes assigned through load
         self.file = None
         self.module = None
@@ -33,7 +57,18 @@ class SettingsManager(object):
         self.functions = {}
         self.properties = {}
         self.plugins = {}
-        self.register_plugin(project.__class__, '')
+        # load arguments and session variables to rebuild project with
+        self.overrides = {}
+        self._load_arguments = {}
+        self._loading = False
+        # incremented with every settings assignment
+        self.version = 0
+        # (function, prefix): (version, resolved settings) see parse_settings
+        self._parsed_settings = {}
+        # instances of cachedpropertyplugins
+        self.plugin_cache = utils.PluginCache()
+        with self.profile('register_plugin %s' % project.__class__.__name__):
+            self.register_plugin(project.__class__, '')
         return
 
     def load(self, defaults={}, resourcedir=True, **override_settings):
@@ -57,23 +92,44 @@ class SettingsManager(object):
         override_settings : dict
             Any settings to override those from default or resources.
         """
+        self.overrides = dict(override_settings)
+        self._load_arguments = {'defaults': dict(defaults),
+                                'resourcedir': resourcedir}
         settings = {'resourcedir': None}
         if resourcedir:
-            self.file = self._find_settings()
-            self.module = utils.load_module_path(
-                self.file, remove_byte_version=True)
+            with self.profile('find settings file'):
+                self.file = self._find_settings()
+            with self.profile('load settings file'):
+                self.module, settings = load_settings_file(self.file)
             # resourcedir cant be overriden
             override_settings["resourcedir"] = osp.dirname(self.file)
-            settings = load_settings(self.file)
 
         settings.update(override_settings)
         # set defaults
         for k, v in defaults.items():
             settings.setdefault(k, v)
         # assign settings to project
-        self(**settings)
+        self._loading = True
+        try:
+            self(**settings)
+        finally:
+            self._loading = False
         return
 
+    def rebuild_arguments(self):
+        """
+        Keyword arguments to rebuild the project with in another process.
+
+        Includes the arguments of the last ``load`` call and any variables
+        assigned after it (session settings).
+        """
+        kwargs = dict(self.overrides)
+        if self._load_arguments.get('defaults'):
+            kwargs['defaults'] = self._load_arguments['defaults']
+        if not self._load_arguments.get('resourcedir', True):
+            kwargs['resourcedir'] = False
+        return kwargs
+
     def _find_settings(self):
         return find_settings_file(self._project.projectdir,
                                   self.settings_file_name)
@@ -98,28 +154,42 @@ class SettingsManager(object):
             settings[obj.__name__] = obj
 
         settypes = sort_settings(settings)
+        # invalidate parsed settings (again at the end, as plugins may use
+        # settings while being instantiated)
+        self.version += 1
+        # new settings replace properties of the same name
+        for st in settypes.values():
+            for k in st:
+                self.properties.pop(k, None)
         # attach to project
         #  attributes
         for k, v in settypes['variables'].items():
             fv = self._filter_abs_path(v)
             setattr(self._project, k, fv)
             self.variables[k] = v
+            if not self._loading:
+                self.overrides[k] = v
         #  functions (name is same as defined in settings)
         for k, f in settypes['functions'].items():
             fm = types.MethodType(f, self._project)
             setattr(self._project, k, fm)
             self.register_function(fm, k)
-        # properties
+        # properties (per instance, dispatched by a class PropertyDispatcher)
         for k, p in settypes['properties'].items():
-            setattr(self._project.__class__, k, p)
+            self._project.__dict__.pop(k, None)
             self.properties[k] = p
+            PropertyDispatcher.install(self._project.__class__, k)
             if hasattr(p, 'plugin'):
-                self.register_plugin(p.plugin, k)
-        # classes to plugins
+                with self.profile('register_plugin %s' % k):
+                    self.register_plugin(p.plugin, k)
+        # classes to plugins (proxies if instantiated on first use)
+        lazy = self.variables.get('lazy_plugins', False)
         for k, c in settypes['classes'].items():
-            instance = self._instatiate(c)
+            instance = LazyPlugin(self, k, c) if lazy else self._instatiate(c)
             setattr(self._project, k, instance)
-            self.register_plugin(c, k)
+            with self.profile('register_plugin %s' % k):
+                self.register_plugin(c, k)
+        self.version += 1
         return
 
     def register_function(self, f, name):
@@ -130,27 +200,18 @@ class SettingsManager(object):
     def register_plugin(self, cls, name):
         assert inspect.isclass(cls)
         assert type(name) is str, name
-        # get functions from instances only if declared
-        if hasattr(cls, 'plugin'):
-            pif = [(n, getattr(cls, n)) for n in cls.plugin]
-        else:
-            pif = [(i, o) for i, o in inspect.getmembers(cls)
-                   if not i.startswith('_')]
-        # filter callables and crawl on
-        for i, o in pif:
+        for i, kind, o in crawl_plugin(cls):
             fname = name + '.' + i if name else i
-            if inspect.isclass(o):
+            if kind == 'plugin':
                 self.register_plugin(o, fname)
-            elif hasattr(o, 'plugin'):
-                c = o.plugin if inspect.isclass(o.plugin) else o.__class__
-                self.register_plugin(c, fname)
             # special case when plugin is only used as function
-            elif i == '__call__':
-                self.register_function(o, name)
-                self.functions[name].name = name
+            elif kind == 'call':
+                finfo = copy.copy(o)
+                finfo.name = name
+                self.functions[name] = finfo
                 return
-            elif callable(o):
-                self.register_function(o, fname)
+            else:
+                self.functions[fname] = o
         if name:
             self.plugins[name] = cls
         return
@@ -158,7 +219,8 @@ class SettingsManager(object):
     def _instatiate(self, cla):
         """Savely instatiate a settings class."""
         try:
-            obj = cla(self._project)
+            with self.profile('instantiate %s' % cla.__name__):
+                obj = cla(self._project)
         except Exception:
             traceback.print_exc()
             print("Failed to add %s to project." % cla.__name__)
@@ -223,65 +285,257 @@ class SettingsManager(object):
         return None if verbose else checked
 
 
+class PropertyDispatcher(object):
+    """
+    Class attribute dispatching to the settings properties of each instance.
+
+    Settings properties are registered per project instance in
+    ``SettingsManager.properties``. A dispatcher is installed once per
+    property name on the project class and looks up the property of the
+    accessing instance (or returns the instance or shadowed class attribute
+    of the same name). This is faster than the ``Project.__getattr__``
+    fall-back and projects dont share or overwrite each other's properties.
+    """
+
+    def __init__(self, name, shadowed=None):
+        self.name = name
+        self.shadowed = shadowed
+        return
+
+    @classmethod
+    def install(cls, projectclass, name):
+        """Install a dispatcher on projectclass unless it already has one."""
+        shadowed = None
+        for c in projectclass.__mro__:
+            if name in c.__dict__:
+                shadowed = c.__dict__[name]
+                break
+        if not isinstance(shadowed, cls):
+            setattr(projectclass, name, cls(name, shadowed))
+        return
+
+    def _property(self, instance):
+        settings = instance.__dict__.get('settings')
+        if settings is not None:
+            return settings.properties.get(self.name)
+        return None
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        # inlined _property for speed
+        instdict = instance.__dict__
+        try:
+            prop = instdict['settings'].properties[self.name]
+        except KeyError:
+            prop = None
+        if prop is not None:
+            return prop.__get__(instance, owner)
+        try:
+            return instdict[self.name]
+        except KeyError:
+            pass
+        if self.shadowed is None:
+            raise AttributeError(self.name)
+        elif hasattr(self.shadowed.__class__, '__get__'):
+            return self.shadowed.__get__(instance, owner)
+        return self.shadowed
+
+    def __set__(self, instance, value):
+        prop = self._property(instance)
+        if prop is not None:
+            prop.__set__(instance, value)
+        else:
+            instance.__dict__[self.name] = value
+        return
+
+    def __delete__(self, instance):
+        try:
+            del instance.__dict__[self.name]
+        except KeyError:
+            raise AttributeError(self.name)
+        return
+
+
+class LazyPlugin(object):
+    """
+    Proxy of a settings class that is instantiated on first use.
+
+    Assigned instead of the plugin instance if the ``lazy_plugins`` setting is
+    True. On first attribute access (or call, item access etc.), the plugin is
+    instantiated through ``SettingsManager._instatiate`` (i.e. with the same
+    error reporting), replaces the proxy on the project and any further use of
+    the proxy is forwarded to the instance.
+    """
+
+    def __init__(self, settingsmanager, name, cls):
+        object.__setattr__(self, '_lazyplugin_settings', settingsmanager)
+        object.__setattr__(self, '_lazyplugin_name', name)
+        object.__setattr__(self, '_lazyplugin_class', cls)
+        return
+
+    def _lazyplugin_instance(self):
+        try:
+            return self.__dict__['_lazyplugin_object']
+        except KeyError:
+            pass
+        if self.__dict__.get('_lazyplugin_instantiating'):
+            raise AttributeError('%s is accessed while being instantiated.'
+                                 % self._lazyplugin_name)
+        self.__dict__['_lazyplugin_instantiating'] = True
+        try:
+            obj = self._lazyplugin_settings._instatiate(self._lazyplugin_class)
+        finally:
+            self.__dict__['_lazyplugin_instantiating'] = False
+        self.__dict__['_lazyplugin_object'] = obj
+        # replace proxy on project if it hasnt been reassigned since
+        project = self._lazyplugin_settings._project
+        if project.__dict__.get(self._lazyplugin_name) is self:
+            setattr(project, self._lazyplugin_name, obj)
+        return obj
+
+    def __getattr__(self, attr):
+        return getattr(self._lazyplugin_instance(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._lazyplugin_instance(), attr, value)
+        return
+
+    def __delattr__(self, attr):
+        delattr(self._lazyplugin_instance(), attr)
+        return
+
+    def __call__(self, *args, **kwargs):
+        return self._lazyplugin_instance()(*args, **kwargs)
+
+    def __getitem__(self, key):
+        return self._lazyplugin_instance()[key]
+
+    def __setitem__(self, key, value):
+        self._lazyplugin_instance()[key] = value
+        return
+
+    def __delitem__(self, key):
+        del self._lazyplugin_instance()[key]
+        return
+
+    def __contains__(self, item):
+        return item in self._lazyplugin_instance()
+
+    def __iter__(self):
+        return iter(self._lazyplugin_instance())
+
+    def __len__(self):
+        return len(self._lazyplugin_instance())
+
+    def __bool__(self):
+        return bool(self._lazyplugin_instance())
+    __nonzero__ = __bool__
+
+    def __dir__(self):
+        return dir(self._lazyplugin_instance())
+
+    def __repr__(self):
+        if '_lazyplugin_object' in self.__dict__:
+            return repr(self.__dict__['_lazyplugin_object'])
+        return ('<Lazy plugin %s (not instantiated yet)>'
+                % self._lazyplugin_name)
+
+
 class FunctionInfo(object):
     """
     Representation of a project function.
+
+    The signature, docs and source code are introspected on first access
+    only and then cached.
     """
     def __init__(self, function):
         if isinstance(function, FunctionInfo):
             function = function.function
         if hasattr(function, 'decorated_function'):
             function = function.decorated_function
+        self.name = function.__name__
+        self.function = function
+        self.__doc__ = inspect.cleandoc(function.__doc__ or '')
+        try:
+            self.cls = function.im_class
+        except AttributeError:
+            # in PY3 unbound methods are just functions
+            self.cls = None
+        return
+
+    @utils.cachedproperty
+    def _signature(self):
+        sig = {'annotations': {}, 'varargs': None}
+        function = self.function
         # get function arguments
         if sys.version_info < (3, 5):
             fspec = inspect.getargspec(function)
-            self.kwargs = fspec.keywords
+            sig['kwargs'] = fspec.keywords
+            sig['varargs'] = fspec.varargs
             args = fspec.args
-            self.defaults = list(fspec.defaults or [])
+            sig['defaults'] = list(fspec.defaults or [])
         else:
             try:
                 fspec = inspect.getfullargspec(function)
-                self.kwargs = fspec.varkw
+                sig['kwargs'] = fspec.varkw
                 args = fspec.args + fspec.kwonlyargs
                 kwodef = [fspec.kwonlydefaults[k] for k in fspec.kwonlyargs]
-                self.annotations = fspec.annotations
-                self.defaults = list(fspec.defaults or []) + kwodef
-                self.varargs = fspec.varargs
+                sig['annotations'] = fspec.annotations
+                sig['defaults'] = list(fspec.defaults or []) + kwodef
+                sig['varargs'] = fspec.varargs
             except TypeError:
-                fspec = None
-                self.kwargs = []
+                sig['kwargs'] = []
                 args = []
-                kwodef = []
-                self.defaults = []
-                self.varargs = []
-        self.doc = inspect.cleandoc(function.__doc__ or '')
-        self.__doc__ = self.doc
-        self.name = function.__name__
-        self.function = function
-        try:
-            code, self.firstcodeline = inspect.getsourcelines(function)
-        except TypeError:
-            code, self.firstcodeline = [], None
-        self.code = "".join(code)
-        nposargs = len(args) - len(self.defaults)
-        self.positional_arguments = list(args)[:nposargs]
-        self.optional_arguments = list(args)[nposargs:]
-
-        try:
-            self.cls = function.im_class
-        except AttributeError:
-            # in PY3 unbound methods are just functions
-            self.cls = None
-        if len(self.positional_arguments) > 0:
-            self.instance_name = self.positional_arguments[0]
-            self.positional_arguments = self.positional_arguments[1:]
+                sig['defaults'] = []
+                sig['varargs'] = []
+        nposargs = len(args) - len(sig['defaults'])
+        positional_arguments = list(args)[:nposargs]
+        sig['optional_arguments'] = list(args)[nposargs:]
+        if len(positional_arguments) > 0:
+            sig['instance_name'] = positional_arguments[0]
+            sig['positional_arguments'] = positional_arguments[1:]
         else:
             # best guess
-            self.instance_name = 'self'
-        opsign = ['%s=%r' % (a, d) for a, d in zip(self.optional_arguments,
-                                                   self.defaults)]
-        self.signiture = ', '.join(self.positional_arguments + opsign)
-        return
+            sig['instance_name'] = 'self'
+            sig['positional_arguments'] = positional_arguments
+        opsign = ['%s=%r' % (a, d) for a, d in zip(sig['optional_arguments'],
+                                                   sig['defaults'])]
+        sig['signiture'] = ', '.join(sig['positional_arguments'] + opsign)
+        return sig
+
+    kwargs = utils.cachedproperty(lambda s: s._signature['kwargs'], 'kwargs')
+    varargs = utils.cachedproperty(lambda s: s._signature['varargs'],
+                                   'varargs')
+    defaults = utils.cachedproperty(lambda s: s._signature['defaults'],
+                                    'defaults')
+    annotations = utils.cachedproperty(lambda s: s._signature['annotations'],
+                                       'annotations')
+    positional_arguments = utils.cachedproperty(
+        lambda s: s._signature['positional_arguments'],
+        'positional_arguments')
+    optional_arguments = utils.cachedproperty(
+        lambda s: s._signature['optional_arguments'], 'optional_arguments')
+    instance_name = utils.cachedproperty(
+        lambda s: s._signature['instance_name'], 'instance_name')
+    signiture = utils.cachedproperty(lambda s: s._signature['signiture'],
+                                     'signiture')
+
+    @utils.cachedproperty
+    def doc(self):
+        return inspect.cleandoc(self.function.__doc__ or '')
+
+    @utils.cachedproperty
+    def _source(self):
+        try:
+            code, firstcodeline = inspect.getsourcelines(self.function)
+        except (TypeError, IOError):
+            code, firstcodeline = [], None
+        return "".join(code), firstcodeline
+
+    code = utils.cachedproperty(lambda s: s._source[0], 'code')
+    firstcodeline = utils.cachedproperty(lambda s: s._source[1],
+                                         'firstcodeline')
 
     def __call__(self, *args, **kwargs):
         print('Call %s via its project.' % self.name)
@@ -326,17 +580,126 @@ def load_settings(pathormodule):
     """
     Load settings from a module or a module file.
     """
-    module = (pathormodule if inspect.ismodule(pathormodule)
-              else utils.load_module_path(pathormodule))
+    if not inspect.ismodule(pathormodule):
+        return load_settings_file(pathormodule)[1]
     # filter settings that should be ignored
-    settings = {n: obj for n, obj in inspect.getmembers(module)
+    settings = {n: obj for n, obj in inspect.getmembers(pathormodule)
                 if not (inspect.ismodule(obj) or n.startswith('_'))}
     return settings
 
 
-def find_settings_file(projectdir, name='settings.py'):
+# file in the projectdir recording the resourcedir, see find_settings_file
+RESOURCEDIR_MARKER = '.modelmanager'
+
+# settings files loaded in this process: realpath: (key, module, settings)
+_settings_file_cache = {}
+
+
+def load_settings_file(path):
+    """
+    Load a settings file and return the module and its settings dictionary.
+
+    The file is compiled and executed only once per process. The result is
+    cached by the file path, modification time and content hash and only
+    re-executed if the file has changed. Clones with a linked resourcedir
+    share the cache entry of their parent.
+
+    Returns
+    -------
+    (module, settings dict) tuple. The settings dict is a copy with deep
+    copies of all variables (see copy_setting), classes and functions are
+    shared.
+    """
+    realpath = osp.realpath(path)
+    with open(realpath, 'rb') as f:
+        source = f.read()
+    key = (os.stat(realpath).st_mtime, hashlib.md5(source).hexdigest())
+    cached = _settings_file_cache.get(realpath)
+    if cached is None or cached[0] != key:
+        name = osp.splitext(osp.basename(path))[0]
+        module = types.ModuleType(name)
+        module.__file__ = osp.abspath(path)
+        code = compile(source, module.__file__, 'exec')
+        exec(code, module.__dict__)
+        cached = (key, module, load_settings(module))
+        _settings_file_cache[realpath] = cached
+    return cached[1], {n: copy_setting(v) for n, v in cached[2].items()}
+
+
+def copy_setting(obj):
+    """
+    Deep copy of a setting variable so that mutable settings are not shared
+    between projects loading the same settings file. Classes, functions and
+    modules as well as objects that cant be copied are returned as is.
+    """
+    if inspect.isclass(obj) or inspect.isroutine(obj) or inspect.ismodule(obj):
+        return obj
+    try:
+        return copy.deepcopy(obj)
+    except Exception:
+        return obj
+
+
+# plugin classes crawled in this process: class: (fingerprint, members)
+_plugin_crawl_cache = {}
+
+
+def crawl_plugin(cls):
+    """
+    Crawl a plugin class for its functions and sub-plugins.
+
+    Returns a list of (name, kind, object) tuples, with kind either 'plugin'
+    (object is the sub-plugin class), 'function' or 'call' (object is a
+    FunctionInfo). The result is cached per class and only renewed if members
+    are added to the class (or its bases), so that classes shared between a
+    project and its clones are only crawled once per process.
+    """
+    plugin = getattr(cls, 'plugin', None)
+    fingerprint = (tuple(len(c.__dict__) for c in cls.__mro__),
+                   tuple(plugin) if type(plugin) in (list, tuple) else None)
+    cached = _plugin_crawl_cache.get(cls)
+    if cached and cached[0] == fingerprint:
+        return cached[1]
+    # get functions from instances only if declared
+    if plugin is not None:
+        pif = [(n, getattr(cls, n)) for n in plugin]
+    else:
+        pif = [(i, o) for i, o in inspect.getmembers(cls)
+               if not i.startswith('_')]
+    # filter callables
+    members = []
+    for i, o in pif:
+        if inspect.isclass(o):
+            members.append((i, 'plugin', o))
+        elif hasattr(o, 'plugin'):
+            c = o.plugin if inspect.isclass(o.plugin) else o.__class__
+            members.append((i, 'plugin', c))
+        elif i == '__call__':
+            members.append((i, 'call', FunctionInfo(o)))
+            break
+        elif callable(o):
+            members.append((i, 'function', FunctionInfo(o)))
+    _plugin_crawl_cache[cls] = (fingerprint, members)
+    return members
+
+
+def find_settings_file(projectdir, name='settings.py',
+                       marker=RESOURCEDIR_MARKER):
+    """
+    Find the settings file in any (dot) directory of projectdir.
+
+    The resourcedir recorded in the marker file in projectdir (see
+    write_resourcedir_marker) is checked first, only if that fails are all
+    directories searched (and the marker written if a single one is found).
+    """
     from modelmanager.project import ProjectDoesNotExist
 
+    recorded = read_resourcedir_marker(projectdir, marker)
+    if recorded:
+        path = osp.join(projectdir, recorded, name)
+        if osp.exists(path):
+            return osp.abspath(path)
+
     # search settings file in any directory in this directory
     settings_dotglob = osp.join(projectdir, '.*', name)
     settings_glob = osp.join(projectdir, '*', name)
@@ -353,9 +716,31 @@ def find_settings_file(projectdir, name='settings.py'):
         msg = 'Found multiple modelmanager settings files (using *):\n'
         msg += '*'+'\n'.join(sfp)
         print(msg)
+    else:
+        try:
+            write_resourcedir_marker(projectdir, osp.dirname(sfp[0]), marker)
+        except (IOError, OSError):
+            pass
     return osp.abspath(sfp[0])
 
 
+def read_resourcedir_marker(projectdir, marker=RESOURCEDIR_MARKER):
+    """Return the resourcedir recorded in projectdir or None."""
+    try:
+        with open(osp.join(projectdir, marker)) as f:
+            return f.read().strip() or None
+    except (IOError, OSError):
+        return None
+
+
+def write_resourcedir_marker(projectdir, resourcedir,
+                             marker=RESOURCEDIR_MARKER):
+    """Record the resourcedir (relative to projectdir) in projectdir."""
+    with open(osp.join(projectdir, marker), 'w') as f:
+        f.write(osp.relpath(resourcedir, projectdir) + '\n')
+    return
+
+
 def sort_settings(settings):
     """
     Separate a dictionary of python objects into setting types.
@@ -390,27 +775,42 @@ def parse_settings(function):
     """
     finfo = FunctionInfo(function)
     iscall = finfo.name == '__call__'
-
-    @functools.wraps(function)
-    def f(*args, **kwargs):
+    # argument to setting name table (without plugin prefix)
+    argsettings = [(a, ('' if iscall else finfo.name+'_') + a)
+                   for a in finfo.optional_arguments]
+    # instance class: (is project, prefix, prefixed argument/setting table)
+    classtables = {}
+
+    def settings_of(inst):
+        """Settings of the optional arguments for inst by argument."""
+        try:
+            isproject, prefix, table = classtables[inst.__class__]
+        except KeyError:
+            from .project import Project
+            isproject = (isinstance(inst, Project) or
+                         Project in inst.__class__.__bases__)
+            prefix = '' if isproject else inst.__class__.__name__ + '_'
+            table = [(a, prefix + s) for a, s in argsettings]
+            classtables[inst.__class__] = isproject, prefix, table
         # get project instance
-        from .project import Project
-        inst = args[0]  # assumes method
-        if isinstance(inst, Project) or Project in inst.__class__.__bases__:
-            prefix = ''
+        if isproject:
             project = inst
         elif hasattr(inst, 'project'):
             project = inst.project
-            prefix = inst.__class__.__name__ + '_'
         else:
             em = ('%s is not a Project instance or doesnt have a project '
                   'attribute.')
             raise AttributeError(em % inst)
-        # get settings
-        for a in finfo.optional_arguments:
-            setname = prefix + ('' if iscall else finfo.name+'_') + a
-            if a not in kwargs and hasattr(project, setname):
-                kwargs[a] = getattr(project, setname)
+        if not table:
+            return {}
+        return _resolve_settings(project, (f, prefix), table)
+
+    @functools.wraps(function)
+    def f(*args, **kwargs):
+        # get settings (assumes method)
+        for a, v in settings_of(args[0]).items():
+            if a not in kwargs:
+                kwargs[a] = v
         # call function
         return function(*args, **kwargs)
     # add signiture to beginning of docstrign if PY2
@@ -429,4 +829,61 @@ All keyword arguements: %s_<kwarg> = value
     finfo.function.__doc__ = (finfo.doc or '') + add_docs
     # attach original function (finfo has also decorated function)
     f.decorated_function = finfo.function
+    f.settings_of = settings_of
     return f
+
+
+def parsed_arguments(method, instance, **kwargs):
+    """
+    Optional arguments of a @parse_settings decorated method as they are
+    passed when calling it on instance with kwargs, i.e. the defaults
+    updated with the settings and kwargs.
+    """
+    finfo = FunctionInfo(method)
+    arguments = dict(zip(finfo.optional_arguments,
+                         copy.deepcopy(finfo.defaults)))
+    arguments.update(method.settings_of(instance))
+    arguments.update(kwargs)
+    return arguments
+
+
+def _resolve_settings(project, key, table):
+    """
+    Get the settings of an (argument, setting name) table from project.
+
+    Which settings are properties and class attributes is cached until the
+    SettingsManager.version changes, instance attributes, class attributes
+    and properties are evaluated on each call.
+    """
+    settings = getattr(project, '__dict__', {}).get('settings')
+    if not isinstance(settings, SettingsManager):
+        return {a: getattr(project, s) for a, s in table
+                if hasattr(project, s)}
+    cached = settings._parsed_settings.get(key)
+    if cached is None or cached[0] != settings.version:
+        classdicts = [c.__dict__ for c in project.__class__.__mro__]
+        dynamic, attributes = [], []
+        for a, s in table:
+            inclass = [d[s] for d in classdicts if s in d]
+            # data descriptors (e.g. properties) take precedence
+            if inclass and hasattr(inclass[0].__class__, '__set__'):
+                dynamic.append((a, s))
+            elif s in settings.properties:
+                dynamic.append((a, s))
+            else:
+                attributes.append((a, s, bool(inclass)))
+        cached = (settings.version, dynamic, attributes)
+        settings._parsed_settings[key] = cached
+    values = {}
+    instattrs = project.__dict__
+    for a, s, inclass in cached[2]:
+        if s in instattrs:
+            values[a] = instattrs[s]
+        elif inclass:
+            values[a] = getattr(project, s)
+    for a, s in cached[1]:
+        try:
+            values[a] = getattr(project, s)
+        except AttributeError:
+            pass
+    return values
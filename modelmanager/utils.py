@@ -3,8 +3,16 @@
 import os
 import os.path as osp
 import sys
+import re
+import errno
 import fnmatch
 import shutil
+import tempfile
+import time
+import contextlib
+import functools
+import threading
+from collections import OrderedDict, namedtuple
 
 
 def load_module_path(path, name=None, remove_byte_version=False):
@@ -51,79 +59,479 @@ def get_paths_pattern(pattern, startdir):
     return matches
 
 
+# file copy modes, see copy_file
+COPY_MODES = ('copy', 'symlink', 'hardlink', 'reflink', 'auto')
+# ioctl request to clone a file (reflink), see linux/fs.h
+FICLONE = 0x40049409
+
+
 def copy_resources(sourcedir, destinationdir, overwrite=False,
-                   ignorepatterns=[], linkpatterns=[], verbose=False):
+                   ignorepatterns=[], linkpatterns=[], verbose=False,
+                   mode='copy', workers=1):
     """
     Copy/sync resource file tree from sourcedir to destinationdir.
 
     overwrite: Overwrite existing files.
+    mode: How files are copied, one of COPY_MODES, see copy_file.
+    workers: Number of threads copying files concurrently, largest first.
+
+    Returns CopyStats(files, bytes, seconds) with a throughput property.
+    """
+    plan = resource_plan(sourcedir, ignorepatterns, linkpatterns, verbose)
+    return apply_resource_plan(plan, destinationdir, overwrite, verbose, mode,
+                               workers)
+
+
+def resource_plan(sourcedir, ignorepatterns=[], linkpatterns=[],
+                  verbose=False):
+    """
+    Walk sourcedir once and evaluate the ignore and link patterns.
+
+    The plan can be applied to many destinations with `apply_resource_plan`.
+    The patterns are matched against the paths relative to sourcedir (see
+    `PathMatcher`), ignored and linked directories are not walked into.
+
+    Returns list of (action, relative path, source path) tuples in walk order,
+    action is 'mkdir', 'link' (source is the absolute link target) or 'copy'.
     """
     def printverbose(args):
         if verbose:
             print(args)
         return
-    pj = osp.join
+    plan = []
+    _plan_directory(sourcedir, '', PathMatcher(ignorepatterns),
+                    PathMatcher(linkpatterns), plan, printverbose)
+    return plan
+
+
+def _plan_directory(path, rpath, ignore, link, plan, printverbose):
+    """Add the entries of path to the resource plan, recursively.
+    (Same order as os.walk: dirs, files, then subdirectories.)"""
+    dirs, files = [], []
+    for entry in os.scandir(path):
+        (dirs if entry.is_dir() else files).append(entry)
+    subdirs = []
+    for entries, isdir in [(dirs, True), (files, False)]:
+        for entry in entries:
+            rel = rpath + os.sep + entry.name if rpath else entry.name
+            if ignore(rel):
+                printverbose('Ignoring %s' % rel)
+            # to symlink
+            elif link(rel):
+                plan.append(('link', rel, osp.abspath(entry.path)))
+            # copy/relink existing symlinks
+            elif entry.is_symlink():
+                lnabs = osp.abspath(osp.join(path, os.readlink(entry.path)))
+                plan.append(('link', rel, lnabs))
+            elif isdir:
+                plan.append(('mkdir', rel, entry.path))
+                subdirs.append((entry.path, rel))
+            else:
+                plan.append(('copy', rel, entry.path))
+    for subpath, rel in subdirs:
+        _plan_directory(subpath, rel, ignore.subtree(rel), link.subtree(rel),
+                        plan, printverbose)
+    return
+
+
+class PathMatcher(object):
+    """
+    Match relative paths against any of a list of fnmatch patterns.
+
+    The patterns are compiled into a single regular expression. Patterns that
+    cant match any path in a directory (by their literal prefix before the
+    first wildcard) are dropped in the matcher of the directory subtree, i.e.
+    most subtrees are walked without any matching.
+    """
+
+    # compiled regular expressions by patterns
+    _regexes = {}
+
+    def __init__(self, patterns):
+        self.patterns = tuple(patterns)
+        self.prefixes = [re.split(r'[*?[]', p, 1)[0] for p in self.patterns]
+        self.regex = None
+        if self.patterns and self.patterns not in self._regexes:
+            # case insensitive like fnmatch.fnmatch if os.path.normcase is
+            flags = re.IGNORECASE if osp.normcase('A') == 'a' else 0
+            self._regexes[self.patterns] = re.compile(
+                '|'.join(fnmatch.translate(p) for p in self.patterns), flags)
+        if self.patterns:
+            self.regex = self._regexes[self.patterns]
+        return
+
+    def __call__(self, path):
+        return self.regex is not None and self.regex.match(path) is not None
+
+    def __bool__(self):
+        return bool(self.patterns)
+    __nonzero__ = __bool__
+
+    def subtree(self, directory):
+        """Return the matcher of the paths in (relative) directory."""
+        if not self.patterns:
+            return self
+        prefix = directory + os.sep
+        patterns = [p for p, pp in zip(self.patterns, self.prefixes)
+                    if pp.startswith(prefix) or prefix.startswith(pp)]
+        if len(patterns) == len(self.patterns):
+            return self
+        return PathMatcher(patterns)
+
+    def __repr__(self):
+        return '<PathMatcher %r>' % (self.patterns,)
+
+
+def apply_resource_plan(plan, destinationdir, overwrite=False, verbose=False,
+                        mode='copy', workers=1):
+    """
+    Create the file tree of a `resource_plan` in destinationdir.
+
+    Links are created with paths relative to their destination.
+    overwrite: Overwrite existing files.
+    mode: How files are copied, one of COPY_MODES, see copy_file.
+    workers: Number of threads copying files concurrently, largest first.
+
+    Returns CopyStats(files, bytes, seconds) of the copied files.
+    """
+    def printverbose(args):
+        if verbose:
+            print(args)
+        return
+    if mode not in COPY_MODES:
+        raise ValueError('mode must be one of %s' % ', '.join(COPY_MODES))
+    st = time.time()
     if not osp.exists(destinationdir):
         printverbose('mkdir %s' % destinationdir)
         os.mkdir(destinationdir)
+    copies = []
+    for action, rpath, src in plan:
+        dest = osp.join(destinationdir, rpath)
+        if action == 'mkdir':
+            if not osp.exists(dest):
+                printverbose('mkdir %s' % dest)
+                os.mkdir(dest)
+        elif action == 'link':
+            rsrc = osp.relpath(src, osp.dirname(osp.abspath(dest)))
+            printverbose('Linking %s to %s' % (dest, rsrc))
+            os.symlink(rsrc, dest)
+        elif not osp.exists(dest) or overwrite:
+            copies.append((os.stat(src).st_size, src, dest))
+    if workers > 1:
+        copies.sort(key=lambda c: c[0], reverse=True)
 
-    walker = os.walk(sourcedir, topdown=True)
-    for path, dirs, files in walker:
-        rpath = osp.relpath(path, sourcedir).replace('.', '')
-        # dirs
-        subsetdirs = []
-        for d in dirs:
-            rdir = pj(rpath, d)
-            src = pj(path, d)
-            dest = pj(destinationdir, rpath, d)
-            if any(fnmatch.fnmatch(rdir, p) for p in ignorepatterns):
-                printverbose('Ignoring %s' % rdir)
-            # dir to symlink with relative path
-            elif any(fnmatch.fnmatch(rdir, p) for p in linkpatterns):
-                rsrc = osp.relpath(pj(path, d), osp.dirname(dest))
-                printverbose('Linking %s to %s' % (dest, rsrc))
-                os.symlink(rsrc, dest)
-            # copy/relink existing symlinks
-            elif osp.islink(src):
-                lnabs = osp.abspath(pj(path, os.readlink(src)))
-                rsrc = osp.relpath(lnabs, osp.dirname(dest))
-                printverbose('Linking %s to %s' % (dest, rsrc))
-                os.symlink(rsrc, dest)
-            # create new dir
-            else:
-                if not osp.exists(dest):
-                    printverbose('mkdir %s' % dest)
-                    os.mkdir(dest)
-                subsetdirs.append(d)
-        # update dirs (change in place will prevent walking into them)
-        dirs[:] = subsetdirs
-        # files
-        for f in files:
-            rfil = osp.join(rpath, f)
-            dest = pj(destinationdir, rpath, f)
-            src = pj(path, f)
-            # ignored files
-            if any(fnmatch.fnmatch(rfil, p) for p in ignorepatterns):
-                printverbose('Ignoring %s' % rfil)
-                continue
-            # file to symlink with relative path
-            elif any(fnmatch.fnmatch(rfil, p) for p in linkpatterns):
-                rsrc = osp.relpath(pj(path, f), osp.dirname(dest))
-                printverbose('Linking %s to %s' % (dest, rsrc))
-                os.symlink(rsrc, dest)
-            # copy/relink existing symlinks
-            elif osp.islink(src):
-                lnabs = osp.abspath(pj(path, os.readlink(src)))
-                rsrc = osp.relpath(lnabs, osp.dirname(dest))
+    def copy(size_src_dest, mode):
+        size, src, dest = size_src_dest
+        printverbose('%s %s to %s' % (mode, src, dest))
+        return copy_file(src, dest, mode)
+    # auto resolves to the mode that worked for the first file
+    if mode == 'auto' and copies:
+        mode = copy(copies[0], mode)
+        remaining = copies[1:]
+    else:
+        remaining = copies
+    if workers > 1 and len(remaining) > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(workers) as pool:
+            # consume results to raise errors
+            list(pool.map(copy, remaining, [mode]*len(remaining)))
+    else:
+        for c in remaining:
+            copy(c, mode)
+    stats = CopyStats(len(copies), sum(c[0] for c in copies), time.time() - st)
+    printverbose(stats)
+    return stats
+
+
+class CopyStats(namedtuple('CopyStats', ['files', 'bytes', 'seconds'])):
+    """Number, bytes and duration of copied files, see apply_resource_plan.
+    """
+
+    @property
+    def throughput(self):
+        """Bytes per second."""
+        return self.bytes / self.seconds if self.seconds else float('inf')
+
+    def __str__(self):
+        return ('Copied %i files (%.1f MB) in %.3fs (%.1f MB/s)'
+                % (self.files, self.bytes/1e6, self.seconds,
+                   self.throughput/1e6))
+
+
+def resource_manifest(plan, destinationdir):
+    """
+    Record the state of a `resource_plan` applied to destinationdir.
+
+    Returns dict of relative path: entry, where the entry is None for
+    directories, the absolute link target for links and the
+    [source mtime, source size, destination mtime, destination size] of files.
+    """
+    manifest = {}
+    for action, rpath, src in plan:
+        if action == 'copy':
+            dst = os.stat(osp.join(destinationdir, rpath))
+            sst = os.stat(src)
+            manifest[rpath] = [sst.st_mtime, sst.st_size,
+                               dst.st_mtime, dst.st_size]
+        else:
+            manifest[rpath] = src if action == 'link' else None
+    return manifest
+
+
+def sync_resource_plan(plan, destinationdir, manifest, verbose=False,
+                       mode='copy', clean=False, keep=[]):
+    """
+    Update destinationdir to a `resource_plan` given a `resource_manifest`.
+
+    Only files that changed in the source or destination since the manifest
+    was recorded are copied, links are recreated if their target changed and
+    paths of the manifest that are not in the plan anymore are removed. Paths
+    that are neither in the manifest nor in the plan are kept unless clean is
+    True (except the relative paths in keep).
+
+    Returns the updated manifest and a dict of copied, linked, created and
+    removed relative paths.
+    """
+    def printverbose(args):
+        if verbose:
+            print(args)
+        return
+
+    def remove(path):
+        if osp.isdir(path) and not osp.islink(path):
+            shutil.rmtree(path)
+        elif osp.lexists(path):
+            os.remove(path)
+        return
+    pj = osp.join
+    if not osp.exists(destinationdir):
+        os.mkdir(destinationdir)
+    changes = {'copied': [], 'linked': [], 'created': [], 'removed': []}
+    planned = set()
+    for action, rpath, src in plan:
+        planned.add(rpath)
+        dest = pj(destinationdir, rpath)
+        if action == 'mkdir':
+            if not osp.isdir(dest) or osp.islink(dest):
+                remove(dest)
+                printverbose('mkdir %s' % dest)
+                os.mkdir(dest)
+                changes['created'].append(rpath)
+        elif action == 'link':
+            rsrc = osp.relpath(src, osp.dirname(osp.abspath(dest)))
+            if not (osp.islink(dest) and os.readlink(dest) == rsrc):
+                remove(dest)
                 printverbose('Linking %s to %s' % (dest, rsrc))
                 os.symlink(rsrc, dest)
-            # copy file
-            elif not osp.exists(dest) or overwrite:
-                printverbose('cp %s to %s' % (src, dest))
-                shutil.copy(src, dest)
+                changes['linked'].append(rpath)
+        else:
+            recorded = manifest.get(rpath)
+            if type(recorded) is list and osp.isfile(dest):
+                sst, dst = os.stat(src), os.stat(dest)
+                current = [sst.st_mtime, sst.st_size,
+                           dst.st_mtime, dst.st_size]
+                if current == recorded:
+                    continue
+            remove(dest)
+            printverbose('%s %s to %s' % (mode, src, dest))
+            mode = copy_file(src, dest, mode)
+            changes['copied'].append(rpath)
+    # remove paths removed from the source, children first
+    for rpath in sorted(set(manifest) - planned, reverse=True):
+        printverbose('Removing %s' % rpath)
+        remove(pj(destinationdir, rpath))
+        changes['removed'].append(rpath)
+    if clean:
+        planned.update(keep)
+        for path, dirs, files in os.walk(destinationdir):
+            rpath = osp.relpath(path, destinationdir)
+            rpath = '' if rpath == '.' else rpath
+            for n in sorted(dirs + files):
+                if pj(rpath, n) not in planned:
+                    printverbose('Removing %s' % pj(rpath, n))
+                    remove(pj(path, n))
+                    changes['removed'].append(pj(rpath, n))
+            # dont walk into removed or linked dirs
+            dirs[:] = [d for d in dirs if pj(rpath, d) in planned and
+                       not osp.islink(pj(path, d))]
+    return resource_manifest(plan, destinationdir), changes
+
+
+def copy_file(source, destination, mode='copy'):
+    """
+    Copy a file with different modes.
+
+    Arguments
+    ---------
+    source, destination : str path
+        File paths, an existing destination is removed first (also if it is
+        a link to source).
+    mode : str
+        copy: Copy content (kernel-side if possible, see copy_content) and
+            permissions.
+        symlink: Create a symlink with a path relative to the destination.
+        hardlink: Create a hard link (same filesystem only).
+        reflink: Create a copy-on-write clone (e.g. btrfs, xfs), raises an
+            OSError if not supported by the filesystem.
+        auto: Try reflink and fall back to copy.
+
+    Returns
+    -------
+    The mode used, i.e. reflink or copy if mode is auto.
+    """
+    if osp.lexists(destination) and mode != 'auto':
+        if (not osp.islink(destination) and
+                osp.realpath(source) == osp.realpath(destination)):
+            raise shutil.SameFileError('%s and %s are the same file.'
+                                       % (source, destination))
+        # dont write into linked files (e.g. of the source)
+        os.remove(destination)
+    if mode == 'copy':
+        copy_content(source, destination)
+        shutil.copymode(source, destination)
+    elif mode == 'symlink':
+        dest = osp.dirname(osp.abspath(destination))
+        os.symlink(osp.relpath(osp.abspath(source), dest), destination)
+    elif mode == 'hardlink':
+        os.link(source, destination)
+    elif mode == 'reflink':
+        reflink(source, destination)
+    elif mode == 'auto':
+        try:
+            return copy_file(source, destination, 'reflink')
+        except (OSError, IOError):
+            return copy_file(source, destination, 'copy')
+    else:
+        raise ValueError('mode must be one of %s' % ', '.join(COPY_MODES))
+    return mode
+
+
+def copy_content(source, destination, blocksize=2**30):
+    """
+    Copy the content of source to destination (file paths).
+
+    Uses the kernel-side os.copy_file_range (Linux, allows server-side copies
+    and reflinks on some filesystems) or os.sendfile if available, otherwise
+    shutil.copyfileobj.
+    """
+    with open(source, 'rb') as src:
+        with open(destination, 'wb') as dest:
+            infd, outfd = src.fileno(), dest.fileno()
+            for name in ('copy_file_range', 'sendfile'):
+                if not hasattr(os, name):
+                    continue
+                copied = 0
+                try:
+                    while True:
+                        if name == 'copy_file_range':
+                            n = os.copy_file_range(infd, outfd, blocksize)
+                        else:
+                            n = os.sendfile(outfd, infd, copied, blocksize)
+                        if n == 0:
+                            return
+                        copied += n
+                except OSError as err:
+                    # unsupported by the filesystems, try next method
+                    if copied or err.errno not in _COPY_UNSUPPORTED_ERRORS:
+                        raise
+            shutil.copyfileobj(src, dest)
     return
 
 
+# errors raised by copy_file_range/sendfile if unsupported, see copy_content
+_COPY_UNSUPPORTED_ERRORS = set(getattr(errno, e) for e in
+                               ['EXDEV', 'ENOSYS', 'EINVAL', 'EOPNOTSUPP',
+                                'ENOTSUP', 'EBADF', 'ETXTBSY']
+                               if hasattr(errno, e))
+
+
+def reflink(source, destination):
+    """
+    Create a copy-on-write clone of source (FICLONE ioctl, Linux only).
+
+    Raises an OSError if the platform or filesystem doesnt support reflinks.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.EOPNOTSUPP, 'Reflinks are not supported.')
+    try:
+        with open(source, 'rb') as src:
+            with open(destination, 'wb') as dest:
+                fcntl.ioctl(dest.fileno(), FICLONE, src.fileno())
+    except (OSError, IOError):
+        if osp.exists(destination):
+            os.remove(destination)
+        raise
+    shutil.copymode(source, destination)
+    return
+
+
+# threads deleting trashed trees in the background, see remove_tree
+REMOVAL_WORKERS = 2
+_removal_executor = []
+_removal_executor_lock = threading.Lock()
+
+
+def remove_tree(path, background=False, trashdir=None):
+    """
+    Remove a directory tree, optionally in a background thread.
+
+    With background, the tree is first moved into trashdir (default: .trash
+    next to path) with an atomic rename, so that path can be recreated
+    immediately, and then deleted by one of REMOVAL_WORKERS threads. The
+    trashdir must be on the same filesystem.
+
+    Returns a concurrent.futures.Future if background else None.
+    """
+    if not background:
+        shutil.rmtree(path)
+        return None
+    path = osp.abspath(path)
+    trashdir = trashdir or osp.join(osp.dirname(path), '.trash')
+    try:
+        os.mkdir(trashdir)
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:
+            raise
+    trashed = tempfile.mkdtemp(prefix=osp.basename(path) + '.', dir=trashdir)
+    try:
+        os.rename(path, osp.join(trashed, osp.basename(path)))
+    except OSError:
+        os.rmdir(trashed)
+        raise
+    with _removal_executor_lock:
+        if not _removal_executor:
+            from concurrent.futures import ThreadPoolExecutor
+            _removal_executor.append(ThreadPoolExecutor(REMOVAL_WORKERS))
+    return _removal_executor[0].submit(shutil.rmtree, trashed)
+
+
+def break_link(path):
+    """
+    Replace a symlinked or hard linked file by an independent copy.
+
+    Call before writing to a file that may be linked to the file of another
+    project (e.g. cloned with mode symlink or hardlink).
+
+    Returns True if a link was broken.
+    """
+    if osp.isdir(path) or not osp.exists(path):
+        return False
+    if not osp.islink(path) and os.stat(path).st_nlink < 2:
+        return False
+    dirname, name = osp.split(osp.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix='.' + name, dir=dirname)
+    os.close(fd)
+    try:
+        shutil.copy(osp.realpath(path), tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return True
+
+
 class propertyplugin(property):
     """
     Class decorator to create a plugin that is instantiated and returned when
@@ -160,6 +568,265 @@ class propertyplugin(property):
         return
 
 
+class cachedpropertyplugin(propertyplugin):
+    """
+    A propertyplugin that keeps its instance per project until invalidated.
+
+    The instance is kept in the ``project.settings.plugin_cache`` and is
+    reinstantiated if:
+        - the modification time or size of the file in its ``path`` attribute
+          changes (e.g. ``ReadWriteDataFrame`` or ``ProjectOrRunData``),
+        - its ``write`` method was called,
+        - the project settings changed,
+        - it was evicted from the cache because the ``plugin_cache_maxmemory``
+          setting (bytes) was exceeded (least recently used first).
+
+    Usage:
+    ------
+    ```
+    @cachedpropertyplugin
+    class discharge(ReadWriteDataFrame):
+        path = 'output/discharge.csv'
+        ...
+
+    project.discharge  # read on first access only
+    ```
+    """
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        project = instance
+        if hasattr(instance, 'project'):
+            project = instance.project
+        settings = getattr(project, '__dict__', {}).get('settings')
+        cache = getattr(settings, 'plugin_cache', None)
+        if cache is None:
+            return self.fget(instance)
+        entry = cache.get(self)
+        if entry is not None:
+            version, path, stat, obj = entry
+            if version == settings.version and file_signature(path) == stat:
+                return obj
+        obj = self.fget(instance)
+        path = getattr(obj, 'path', None)
+        path = path if isinstance(path, str) else None
+        # invalidate on write
+        if callable(getattr(obj, 'write', None)):
+            obj.write = self._invalidating(obj.write, cache)
+        maxmemory = settings.variables.get('plugin_cache_maxmemory')
+        cache.put(self, (settings.version, path, file_signature(path), obj),
+                  memory_size(obj), maxmemory)
+        return obj
+
+    def _invalidating(self, method, cache):
+        @functools.wraps(method)
+        def invalidating_method(*args, **kwargs):
+            try:
+                return method(*args, **kwargs)
+            finally:
+                cache.pop(self, None)
+        return invalidating_method
+
+
+class PluginCache(OrderedDict):
+    """
+    Least recently used cache of plugin instances with an optional memory
+    budget, see ``cachedpropertyplugin``.
+    """
+
+    def __init__(self):
+        OrderedDict.__init__(self)
+        self.memory = {}
+        return
+
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+        # move to most recently used
+        value = OrderedDict.pop(self, key)
+        OrderedDict.__setitem__(self, key, value)
+        return value
+
+    def put(self, key, value, memory=0, maxmemory=None):
+        """Add value and evict least recently used values beyond maxmemory."""
+        self.pop(key, None)
+        OrderedDict.__setitem__(self, key, value)
+        self.memory[key] = memory
+        if maxmemory is not None:
+            while len(self) > 1 and self.total_memory > maxmemory:
+                self.pop(next(iter(self)))
+        return
+
+    def pop(self, key, *default):
+        self.memory.pop(key, None)
+        return OrderedDict.pop(self, key, *default)
+
+    def clear(self):
+        OrderedDict.clear(self)
+        self.memory.clear()
+        return
+
+    @property
+    def total_memory(self):
+        return sum(self.memory.values())
+
+
+def file_signature(path):
+    """Return (modification time, size) of path or None if it doesnt exist."""
+    if path is None:
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime, st.st_size
+
+
+def memory_size(obj):
+    """Estimate the memory size of obj in bytes (deep for pandas objects)."""
+    if hasattr(obj, 'memory_usage'):
+        try:
+            mem = obj.memory_usage(deep=True)
+            return int(mem.sum() if hasattr(mem, 'sum') else mem)
+        except Exception:
+            pass
+    if hasattr(obj, 'nbytes'):
+        return int(obj.nbytes)
+    return sys.getsizeof(obj)
+
+
+class cachedproperty(object):
+    """
+    Read-only property that is computed on first access and then stored as
+    instance attribute.
+
+    Usage:
+    ------
+    ```
+    class A:
+        @cachedproperty
+        def expensive(self):
+            return compute()
+    ```
+    """
+
+    def __init__(self, function, name=None):
+        self.function = function
+        self.__name__ = name or function.__name__
+        self.__doc__ = function.__doc__
+        return
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        value = self.function(instance)
+        instance.__dict__[self.__name__] = value
+        return value
+
+
+class PhaseProfiler(object):
+    """
+    Record wall time and peak memory of (nested) named phases.
+
+    Usage:
+    ------
+    ```
+    profiler = PhaseProfiler()
+    with profiler('some phase'):
+        do_something()
+    profiler.phases -> [{'phase': 'some phase', 'seconds': 0.1, ...}]
+    print(profiler.report())
+    ```
+    Peak memory (bytes allocated above the memory at the start of the phase)
+    is traced with tracemalloc if memory=True, which slows down execution.
+    Tracing is started and stopped by each outermost phase.
+    A disabled profiler returns a no-op context.
+    """
+
+    def __init__(self, enabled=True, memory=True):
+        self.enabled = enabled
+        self.memory = memory
+        self.phases = []
+        # [start memory, peak memory] of running phases
+        self._stack = []
+        self._tracing = False
+        return
+
+    def start(self):
+        """Start tracing memory allocations (done by the outermost phase)."""
+        import tracemalloc
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        return
+
+    def stop(self):
+        """Stop tracing memory if started by this profiler."""
+        if self._tracing:
+            import tracemalloc
+            tracemalloc.stop()
+            self._tracing = False
+        return
+
+    def _traced_memory(self):
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            return None, None
+        current, peak = tracemalloc.get_traced_memory()
+        # propagate peak to running phases and reset it
+        for s in self._stack:
+            s[1] = max(s[1] or 0, peak)
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        return current, peak
+
+    @contextlib.contextmanager
+    def __call__(self, phase):
+        if not self.enabled:
+            yield
+            return
+        if not self._stack:
+            self.start()
+        record = {'phase': phase, 'depth': len(self._stack)}
+        self.phases.append(record)
+        current = self._traced_memory()[0]
+        self._stack.append([current, current])
+        start = time.time()
+        try:
+            yield
+        finally:
+            record['seconds'] = time.time() - start
+            self._traced_memory()
+            startmem, peak = self._stack.pop()
+            record['peak_memory'] = (peak - startmem if startmem is not None
+                                     else None)
+            # dont keep tracing between phases
+            if not self._stack:
+                self.stop()
+        return
+
+    @property
+    def total_seconds(self):
+        return sum(p['seconds'] for p in self.phases
+                   if p['depth'] == 0 and 'seconds' in p)
+
+    def report(self):
+        """Return a printable report of all phases."""
+        lines = ['%-50s %10s %12s' % ('Phase', 'Time [ms]', 'Peak [KiB]')]
+        for p in self.phases:
+            name = '  '*p['depth'] + p['phase']
+            mem = p.get('peak_memory')
+            lines.append('%-50s %10.2f %12s' % (
+                name[:50], p.get('seconds', float('nan'))*1e3,
+                '%.1f' % (mem/1024.) if mem is not None else '-'))
+        lines.append('%-50s %10.2f' % ('Total', self.total_seconds*1e3))
+        return '\n'.join(lines)
+
+    def __repr__(self):
+        return '<PhaseProfiler with %s phases>' % len(self.phases)
+
+
 class GroupPlugin(object):
     """
     An abstract class to group functionality.
@@ -0,0 +1,639 @@
+"""Benchmarks of core modelmanager operations.
+
+The benchmarks run on synthetic projects of configurable size (number of
+settings, plugins, templates and files). Results are appended to a JSON lines
+file and compared to the last run with the same sizes to find regressions.
+
+Run from the tests directory, e.g.:
+python benchmarks.py
+python benchmarks.py startup clone --plugins=50 --files=1000
+python benchmarks.py --fail-on-regression  # exit code 1 on regression
+"""
+from __future__ import print_function
+import os
+import os.path as osp
+import sys
+import shutil
+import timeit
+import time
+import json
+import argparse
+import platform
+import subprocess
+import contextlib
+
+import modelmanager as mm
+from modelmanager import utils, settings as mmsettings
+from modelmanager.plugins.templates import Template
+
+SIZES = {'settings': 100, 'plugins': 20, 'templates': 20, 'files': 200}
+RESULTS_FILE = 'benchmark_results.jsonl'
+
+PLUGIN_SETTINGS = '''
+class plugin{i}(object):
+    """Synthetic plugin {i} installing resources like the browser plugin."""
+
+    def __init__(self, project):
+        self.project = project
+        self.resourcedir = os.path.join(project.resourcedir, 'plugin{i}')
+        utils.copy_resources(_resources, self.resourcedir)
+        return
+
+    def method(self, a, b=1):
+        return a + b
+'''
+TEMPLATE = "Parameters of file {i}\nalpha{i} {{alpha{i}:f}}\nn{i} {{n{i}:d}}\n"
+TEMPLATED = "Parameters of file {i}\nalpha{i} 0.5\nn{i} 10\n"
+
+
+def create_synthetic_project(projectdir, settings=0, plugins=0, templates=0,
+                             files=0):
+    """
+    Create a project with a number of synthetic settings, plugins, template
+    files (with templated files) and files in the project tree.
+    """
+    if osp.exists(projectdir):
+        shutil.rmtree(projectdir)
+    os.makedirs(projectdir)
+    project = mm.project.setup(projectdir=projectdir)
+    lines = ['import os',
+             'from modelmanager import utils',
+             'from modelmanager.plugins import clone, templates',
+             '_resources = os.path.join(os.path.dirname(utils.__file__), '
+             '"resources")']
+    lines += ['setting%i = %i' % (i, i) for i in range(settings)]
+    lines += [PLUGIN_SETTINGS.format(i=i) for i in range(plugins)]
+    with open(project.settings.file, 'w') as f:
+        f.write('\n'.join(lines))
+    # templates
+    tmpltdir = osp.join(project.resourcedir, 'templates', 'input')
+    os.makedirs(tmpltdir)
+    os.makedirs(osp.join(projectdir, 'input'))
+    for i in range(templates):
+        with open(osp.join(tmpltdir, 'param%i.txt' % i), 'w') as f:
+            f.write(TEMPLATE.format(i=i))
+        with open(osp.join(projectdir, 'input', 'param%i.txt' % i), 'w') as f:
+            f.write(TEMPLATED.format(i=i))
+    # other files in 10 directories
+    for i in range(files):
+        d = osp.join(projectdir, 'data', 'dir%i' % (i % 10))
+        if not osp.exists(d):
+            os.makedirs(d)
+        with open(osp.join(d, 'file%i.txt' % i), 'w') as f:
+            f.write('%i\n' % i * 100)
+    return project.projectdir
+
+
+@contextlib.contextmanager
+def synthetic_project(projectdir='benchmarkproject', **sizes):
+    """Context of a synthetic project that is removed afterwards."""
+    projectdir = create_synthetic_project(projectdir, **sizes)
+    try:
+        yield projectdir
+    finally:
+        shutil.rmtree(projectdir)
+
+
+def best_time(function, repeat=5, number=1, setup=None):
+    """Return the best time of repeated runs in seconds.
+
+    setup is called (untimed) before every run.
+    """
+    times = []
+    for r in range(repeat):
+        if setup:
+            setup()
+        times.append(timeit.timeit(function, number=number) / number)
+    return min(times)
+
+
+def startup(repeat=5, **sizes):
+    """Project startup time with eager vs. lazy plugin instantiation."""
+    with synthetic_project(**sizes) as projectdir:
+        # first instantiation installs plugin resources
+        mm.Project(projectdir)
+        results = {
+            'eager': best_time(lambda: mm.Project(projectdir), repeat),
+            'lazy': best_time(
+                lambda: mm.Project(projectdir, lazy_plugins=True), repeat),
+            }
+    return results
+
+
+def attribute_access(repeat=5, number=100000, **sizes):
+    """Access time of settings variables, plugins and properties.
+
+    Settings properties are dispatched per project instance, the 'class
+    property' row shows properties assigned to the project class (as before).
+    """
+    sizes['plugins'] = max(sizes.get('plugins', 0), 1)
+    with synthetic_project(**sizes) as projectdir:
+        project = mm.Project(projectdir)
+        project.settings(bench_property=property(lambda p: p.projectdir))
+
+        class ClassPropertyProject(mm.Project):
+            bench_property = property(lambda p: p.projectdir)
+        classproject = ClassPropertyProject(projectdir)
+        accessors = {
+            'variable': lambda: project.resourcedir,
+            'plugin': lambda: project.plugin0,
+            'property': lambda: project.bench_property,
+            'class property': lambda: classproject.bench_property,
+            }
+        results = {n: best_time(f, repeat, number=number)
+                   for n, f in accessors.items()}
+    return results
+
+
+def register_plugin(repeat=5, **sizes):
+    """Registration of all plugins with a cold and warm crawl cache."""
+    with synthetic_project(**sizes) as projectdir:
+        project = mm.Project(projectdir)
+        settings = project.settings
+
+        def register():
+            for n, c in list(settings.plugins.items()):
+                if '.' not in n:
+                    settings.register_plugin(c, n)
+        results = {
+            'cold': best_time(register, repeat,
+                              setup=mmsettings._plugin_crawl_cache.clear),
+            'warm': best_time(register, repeat),
+            }
+    return results
+
+
+def clone(repeat=5, **sizes):
+    """Creation of a fresh clone and loading of an existing clone."""
+    with synthetic_project(**sizes) as projectdir:
+        project = mm.Project(projectdir)
+        project.clone('benchmark')
+        results = {
+            'create': best_time(
+                lambda: project.clone('benchmark', fresh=True), repeat,
+                setup=project.clone.loaded_clones.clear),
+            'load': best_time(
+                lambda: project.clone['benchmark'], repeat,
+                setup=project.clone.loaded_clones.clear),
+            }
+    return results
+
+
+def clone_many(repeat=5, clones=20, **sizes):
+    """Creation of many clones sequentially vs. with clone.many."""
+    with synthetic_project(**sizes) as projectdir:
+        project = mm.Project(projectdir)
+        names = ['benchmark%i' % i for i in range(clones)]
+
+        def remove():
+            project.clone.loaded_clones.clear()
+            shutil.rmtree(project.clone_dir)
+            os.mkdir(project.clone_dir)
+        results = {
+            'sequential': best_time(
+                lambda: [project.clone(n) for n in names], repeat,
+                setup=remove),
+            'many': best_time(
+                lambda: project.clone.many(names), repeat, setup=remove),
+            }
+        remove()
+    return results
+
+
+def clone_modes(repeat=5, **sizes):
+    """Creation of a fresh clone with the different file copy modes."""
+    with synthetic_project(**sizes) as projectdir:
+        project = mm.Project(projectdir)
+        results = {}
+        for mode in ['copy', 'hardlink', 'symlink', 'auto']:
+            results[mode] = best_time(
+                lambda: project.clone(mode, fresh=True, mode=mode), repeat,
+                setup=project.clone.loaded_clones.clear)
+    return results
+
+
+def clone_sync(repeat=5, **sizes):
+    """Updating a clone after a parameter file changed by a fresh clone vs.
+    an incremental sync."""
+    sizes['templates'] = max(sizes.get('templates', 0), 1)
+    with synthetic_project(**sizes) as projectdir:
+        project = mm.Project(projectdir)
+        project.clone('benchmark')
+        parameters = osp.join(projectdir, 'input', 'param0.txt')
+
+        def change():
+            project.clone.loaded_clones.clear()
+            with open(parameters, 'a') as f:
+                f.write(' ')
+        results = {
+            'fresh': best_time(
+                lambda: project.clone('benchmark', fresh=True), repeat,
+                setup=change),
+            'sync': best_time(
+                lambda: project.clone.sync('benchmark'), repeat,
+                setup=change),
+            }
+    return results
+
+
+def clone_pool(repeat=5, **sizes):
+    """Getting a clean clone (and changing a file) with a fresh clone vs.
+    checking it out of and into a clone pool."""
+    sizes['templates'] = max(sizes.get('templates', 0), 1)
+    with synthetic_project(**sizes) as projectdir:
+        project = mm.Project(projectdir)
+        pool = project.clone.pool(1)
+
+        def fresh():
+            clone = project.clone('benchmark', fresh=True)
+            clone.templates(alpha0=0.1)
+            project.clone.loaded_clones.clear()
+
+        def borrow():
+            with pool.borrow() as clone:
+                clone.templates(alpha0=0.1)
+        results = {'fresh': best_time(fresh, repeat),
+                   'pool': best_time(borrow, repeat)}
+    return results
+
+
+def clone_names(repeat=5, clones=5000, **sizes):
+    """Listing clones from the clone index vs. globbing the clone_dir."""
+    from glob import glob
+    with synthetic_project(**sizes) as projectdir:
+        project = mm.Project(projectdir)
+        for i in range(clones):
+            os.mkdir(osp.join(project.clone_dir, 'clone%05i' % i))
+        project.clone.rebuild_index()
+
+        def globbed():
+            names = glob(osp.join(project.clone_dir, '*'))
+            return [osp.relpath(n, project.clone_dir)
+                    for n in sorted(names) if osp.isdir(n)]
+        results = {'index': best_time(project.clone.names, repeat),
+                   'glob': best_time(globbed, repeat)}
+    return results
+
+
+def templates(repeat=5, **sizes):
+    """Getting and setting a single template value."""
+    sizes['templates'] = max(sizes.get('templates', 0), 1)
+    with synthetic_project(**sizes) as projectdir:
+        project = mm.Project(projectdir)
+        results = {
+            'get': best_time(lambda: project.templates('alpha0'), repeat),
+            'set': best_time(lambda: project.templates(alpha0=0.1), repeat),
+            }
+    return results
+
+
+def template_call(repeat=5, parameter_files=200, **sizes):
+    """Getting and setting a value with templates() among many templated
+    files, with the field index vs. parsing all templates (legacy)."""
+    sizes['templates'] = parameter_files
+    with synthetic_project(**sizes) as projectdir:
+        project = mm.Project(projectdir)
+
+        def legacy_get():
+            found = {}
+            for t in project.templates.get_templates():
+                found.update(t.read_values())
+            return found['alpha0']
+        results = {
+            'legacy get': best_time(legacy_get, repeat),
+            'get': best_time(lambda: project.templates('alpha0'), repeat),
+            'set': best_time(lambda: project.templates(alpha0=0.1), repeat),
+            }
+    return results
+
+
+def template_batch(repeat=5, parameter_files=200, **sizes):
+    """Setting two values in each of many templated files with one
+    templates() call per value vs. all calls in templates.batch()."""
+    sizes['templates'] = templates = parameter_files
+    with synthetic_project(**sizes) as projectdir:
+        project = mm.Project(projectdir)
+
+        def set_values():
+            for i in range(templates):
+                project.templates(**{'alpha%i' % i: 0.1})
+                project.templates(**{'n%i' % i: i})
+
+        def batch():
+            with project.templates.batch():
+                set_values()
+        results = {
+            'calls': best_time(set_values, repeat),
+            'batch': best_time(batch, repeat),
+            }
+    return results
+
+
+def template_render(repeat=5, sets=100, parameter_files=20, **sizes):
+    """Rendering parameter sets into as many directories with
+    templates.render vs. writing each templated file of each directory with
+    the legacy writer."""
+    sizes['templates'] = parameter_files
+    with synthetic_project(**sizes) as projectdir:
+        project = mm.Project(projectdir)
+        parameters = [{'alpha%i' % i: s * 0.1 for i in range(parameter_files)}
+                      for s in range(sets)]
+        dests = [osp.join(projectdir, 'sets', 'set%i' % i)
+                 for i in range(sets)]
+        project.templates.render(parameters, dests)
+        tmplts = project.templates.get_templates('input/*')
+
+        def write():
+            for values, dest in zip(parameters, dests):
+                for t in tmplts:
+                    path = osp.join(dest, osp.relpath(t.filepath, projectdir))
+                    dt = Template(t.templatepath, path)
+                    legacy_write_values(dt, **{k: v for k, v in values.items()
+                                               if k in dt.fields})
+        results = {
+            'legacy write': best_time(write, repeat),
+            'render': best_time(
+                lambda: project.templates.render(parameters, dests), repeat),
+            }
+    return results
+
+
+def legacy_read_values(template):
+    """Template.read_values without the template cache."""
+    import parse
+    with open(template.templatepath) as f:
+        tw = f.read().split()
+    with open(template.filepath) as f:
+        fw = f.read().split()
+    return parse.parse(' '.join(tw), ' '.join(fw)).named
+
+
+def legacy_write_values(template, **values):
+    """Template.write_values without the template cache."""
+    read = legacy_read_values(template)
+    read.update(values)
+    with open(template.templatepath) as f:
+        formatted = f.read().format(**read)
+    with open(template.filepath, 'w') as f:
+        f.write(formatted)
+
+
+def template_io(repeat=5, parameter_files=1000, **sizes):
+    """Reading and writing all values of many templated files with and
+    without (legacy) the template cache."""
+    sizes['templates'] = templates = parameter_files
+    with synthetic_project(**sizes) as projectdir:
+        project = mm.Project(projectdir)
+        tmplts = [project.templates['input/param%i.txt' % i]
+                  for i in range(templates)]
+
+        def read(function):
+            return lambda: [function(t) for t in tmplts]
+
+        def write(function):
+            return lambda: [function(t, **{'n%i' % i: i})
+                            for i, t in enumerate(tmplts)]
+        results = {
+            'legacy read': best_time(read(legacy_read_values), repeat),
+            'legacy write': best_time(write(legacy_write_values), repeat),
+            'read': best_time(read(lambda t: t.read_values()), repeat),
+            'write': best_time(write(lambda t, **v: t.write_values(**v)),
+                               repeat),
+            }
+    return results
+
+
+def template_spans(repeat=5, parameters=5000, **sizes):
+    """Setting one value in a large templated file by patching its span vs.
+    reformatting the whole (cached) template and the legacy writer."""
+    with synthetic_project(**sizes) as projectdir:
+        project = mm.Project(projectdir)
+        tmpltdir = osp.join(project.templates.resourcedir, 'input')
+        lines = ['p%i {p%i:f}' % (i, i) for i in range(parameters)]
+        with open(osp.join(tmpltdir, 'table.txt'), 'w') as f:
+            f.write('Parameter table\n' + '\n'.join(lines))
+        with open(osp.join(projectdir, 'input', 'table.txt'), 'w') as f:
+            f.write('Parameter table\n' +
+                    '\n'.join('p%i %f' % (i, i) for i in range(parameters)))
+        tmplt = project.templates['input/table.txt']
+
+        def reformat(**values):
+            read = tmplt.read_values()
+            read.update(values)
+            with open(tmplt.filepath, 'w') as f:
+                f.write(tmplt.template.format(**read))
+        value = 'p%i' % (parameters // 2)
+        results = {
+            'legacy write': best_time(
+                lambda: legacy_write_values(tmplt, **{value: 1.5}), repeat),
+            'reformat': best_time(lambda: reformat(**{value: 2.5}), repeat),
+            'patch': best_time(lambda: tmplt.write_values(**{value: 3.5}),
+                               repeat),
+            'patch length': best_time(
+                lambda: tmplt.write_values(**{value: 1234.5}), repeat),
+            }
+    return results
+
+
+def copy_resources(repeat=5, large_files=4, large_size=50, workers=8,
+                   **sizes):
+    """Copying the project tree (with a number of large files, size in MB)
+    with utils.copy_resources with one and many threads."""
+    with synthetic_project(**sizes) as projectdir:
+        os.mkdir(osp.join(projectdir, 'forcing'))
+        for i in range(large_files):
+            path = osp.join(projectdir, 'forcing', '%i.bin' % i)
+            with open(path, 'wb') as f:
+                f.write(os.urandom(large_size*2**20))
+        destination = projectdir + '_copy'
+
+        def remove():
+            if osp.exists(destination):
+                shutil.rmtree(destination)
+        results = {}
+        try:
+            for n, w in [('copy', 1), ('parallel', workers)]:
+                results[n] = best_time(
+                    lambda: utils.copy_resources(projectdir, destination,
+                                                 workers=w),
+                    repeat, setup=remove)
+        finally:
+            remove()
+    return results
+
+
+def legacy_resource_plan(sourcedir, ignorepatterns=[], linkpatterns=[]):
+    """utils.resource_plan with os.walk and fnmatch (before PathMatcher)."""
+    import fnmatch
+    pj = osp.join
+    plan = []
+    for path, dirs, files in os.walk(sourcedir, topdown=True):
+        rpath = osp.relpath(path, sourcedir)
+        rpath = '' if rpath == '.' else rpath
+        subsetdirs = []
+        for d in dirs:
+            rdir = pj(rpath, d)
+            src = pj(path, d)
+            if any(fnmatch.fnmatch(rdir, p) for p in ignorepatterns):
+                pass
+            elif any(fnmatch.fnmatch(rdir, p) for p in linkpatterns):
+                plan.append(('link', rdir, osp.abspath(src)))
+            elif osp.islink(src):
+                lnabs = osp.abspath(pj(path, os.readlink(src)))
+                plan.append(('link', rdir, lnabs))
+            else:
+                plan.append(('mkdir', rdir, src))
+                subsetdirs.append(d)
+        dirs[:] = subsetdirs
+        for f in files:
+            rfil = pj(rpath, f)
+            src = pj(path, f)
+            if any(fnmatch.fnmatch(rfil, p) for p in ignorepatterns):
+                pass
+            elif any(fnmatch.fnmatch(rfil, p) for p in linkpatterns):
+                plan.append(('link', rfil, osp.abspath(src)))
+            elif osp.islink(src):
+                lnabs = osp.abspath(pj(path, os.readlink(src)))
+                plan.append(('link', rfil, lnabs))
+            else:
+                plan.append(('copy', rfil, src))
+    return plan
+
+
+def resource_plan(repeat=5, patterns=20, **sizes):
+    """Walking the project tree and matching ignore/link patterns with
+    os.walk and fnmatch (legacy) vs. os.scandir and PathMatcher."""
+    with synthetic_project(**sizes) as projectdir:
+        ignore = ['output%i/*' % i for i in range(patterns//2)] + ['*.log']
+        links = ['input/forcing%i*' % i for i in range(patterns//2)]
+        args = (projectdir, ignore, links)
+        assert legacy_resource_plan(*args) == utils.resource_plan(*args)
+        results = {
+            'legacy': best_time(lambda: legacy_resource_plan(*args), repeat),
+            'compiled': best_time(lambda: utils.resource_plan(*args), repeat),
+            }
+    return results
+
+
+def settings_discovery(repeat=5, subdirs=10000, **sizes):
+    """Finding the settings file with the resourcedir marker vs. globbing
+    in a projectdir with many subdirectories."""
+    with synthetic_project(**sizes) as projectdir:
+        for i in range(subdirs):
+            os.mkdir(osp.join(projectdir, 'output%05i' % i))
+        marker = osp.join(projectdir, mmsettings.RESOURCEDIR_MARKER)
+        results = {
+            'marker': best_time(
+                lambda: mmsettings.find_settings_file(projectdir), repeat),
+            'glob': best_time(
+                lambda: mmsettings.find_settings_file(projectdir), repeat,
+                setup=lambda: os.remove(marker)),
+            }
+    return results
+
+
+BENCHMARKS = {f.__name__: f for f in [startup, attribute_access,
+                                      register_plugin, settings_discovery,
+                                      resource_plan,
+                                      clone, clone_many, clone_modes,
+                                      clone_sync, clone_pool, clone_names,
+                                      templates, template_call, template_batch,
+                                      template_io, template_spans,
+                                      template_render,
+                                      copy_resources]}
+
+
+def format_time(seconds):
+    for unit, factor in [('s', 1), ('ms', 1e3), ('us', 1e6)]:
+        if seconds*factor >= 1:
+            break
+    return '%.3f %s' % (seconds*factor, unit)
+
+
+def git_revision():
+    try:
+        out = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                      stderr=subprocess.STDOUT)
+        return out.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def read_results(path=RESULTS_FILE):
+    """Read all recorded benchmark results."""
+    if not osp.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(l) for l in f if l.strip()]
+
+
+def run(names=None, sizes=SIZES, repeat=5, results_file=RESULTS_FILE,
+        threshold=0.2, record=True):
+    """
+    Run benchmarks, print and compare them with the last recorded run.
+
+    Returns a list of (benchmark, case, previous, current) regressions that
+    are slower by more than threshold (fraction).
+    """
+    previous = {}
+    for r in read_results(results_file):
+        if r['sizes'] == sizes:
+            previous[r['benchmark']] = r['results']
+    regressions = []
+    records = []
+    for n in names or sorted(BENCHMARKS):
+        # silence project setup messages
+        with open(os.devnull, 'w') as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                results = BENCHMARKS[n](repeat=repeat, **dict(sizes))
+            finally:
+                sys.stdout = stdout
+        print('%s:' % n)
+        for case, t in sorted(results.items()):
+            prev = previous.get(n, {}).get(case)
+            change = ''
+            if prev:
+                change = '%+6.1f%%' % ((t - prev)/prev*100)
+                if t > prev*(1 + threshold):
+                    change += ' REGRESSION'
+                    regressions.append((n, case, prev, t))
+            print('  %-15s %12s %s' % (case, format_time(t), change))
+        records.append({'benchmark': n, 'results': results, 'sizes': sizes,
+                        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                        'revision': git_revision(),
+                        'version': mm.__version__,
+                        'python': platform.python_version()})
+    if record:
+        with open(results_file, 'a') as f:
+            for r in records:
+                f.write(json.dumps(r, sort_keys=True) + '\n')
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('benchmarks', nargs='*',
+                        help='Benchmarks to run (default: all): ' +
+                        ', '.join(sorted(BENCHMARKS)))
+    for s, d in sorted(SIZES.items()):
+        parser.add_argument('--'+s, type=int, default=d,
+                            help='Number of synthetic %s (default: %s)'
+                            % (s, d))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--results', default=RESULTS_FILE,
+                        help='JSON lines file to record results in.')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Relative slow-down considered a regression.')
+    parser.add_argument('--no-record', action='store_true',
+                        help='Dont record the results.')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error('Unknown benchmarks: %s' % ', '.join(sorted(unknown)))
+    sizes = {s: getattr(args, s) for s in SIZES}
+    regressions = run(args.benchmarks, sizes, args.repeat, args.results,
+                      args.threshold, not args.no_record)
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
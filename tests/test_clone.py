@@ -3,9 +3,15 @@ import unittest
 import os
 import os.path as osp
 import shutil
+import pickle
+import time
+from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor,
+                                TimeoutError, Future)
 import cProfile, pstats
 
+import modelmanager as mm
 from modelmanager.project import ProjectDoesNotExist
+from modelmanager import utils
 
 from test_project import create_project
 
@@ -14,6 +20,30 @@ from modelmanager.plugins import clone
 """
 
 
+def clone_projectdir(clone):
+    return clone.projectdir, clone.clonename, clone.cloneparent.projectdir
+
+
+def map_function(clone):
+    if clone.fail:
+        raise ValueError(clone.clonename)
+    time.sleep(clone.sleep)
+    return clone.clonename, os.getpid()
+
+
+def borrow_clone(pool, i=0):
+    """Check out a pool clone and change it."""
+    with pool.borrow() as clone:
+        output = osp.join(clone.projectdir, 'output', 'model.out')
+        assert not osp.exists(output)
+        with open(output, 'w') as f:
+            f.write(str(i))
+        with open(osp.join(clone.projectdir, 'input/params.txt'), 'w') as f:
+            f.write(str(i))
+        time.sleep(0.01)
+    return clone.clonename
+
+
 class Clones(unittest.TestCase):
 
     projectdir = 'clonetestproject'
@@ -88,11 +118,297 @@ class Clones(unittest.TestCase):
         clone.clone('testclone', verbose=self.verbose)
         self.assertTrue(osp.exists(self.cd('testclone/mm/clones/testclone')))
 
+    def test_pickle(self):
+        clone = self.project.clone('testclone', verbose=self.verbose)
+        clone2 = clone.clone('testclone2', verbose=self.verbose)
+        for c in (clone, clone2):
+            self.assertIs(pickle.loads(pickle.dumps(c)), c)
+        with ProcessPoolExecutor(2) as pool:
+            result = list(pool.map(clone_projectdir, [clone, clone2]))
+        self.assertEqual(result[0], (clone.projectdir, 'testclone',
+                                     self.project.projectdir))
+        self.assertEqual(result[1][2], clone.projectdir)
+
+    def test_many(self):
+        self.project.settings(clone_ignore=['output/*'])
+        self.project.clone('existing')
+        # not a project
+        os.mkdir(self.cd('blocked'))
+        names = ['existing', 'blocked'] + ['clone%i' % i for i in range(5)]
+        with self.assertWarns(UserWarning):
+            clones = self.project.clone.many(names, workers=3)
+        self.assertEqual([c and c.clonename for c in clones],
+                         names[:1] + [None] + names[2:])
+        report = self.project.clone.report
+        self.assertEqual(list(report), names)
+        self.assertIsInstance(report['blocked'].error, ProjectDoesNotExist)
+        for n in names[2:]:
+            self.assertIsNone(report[n].error)
+            self.assertGreater(report[n].seconds, 0)
+            self.assertTrue(osp.islink(self.cd(n, 'mm')))
+            self.assertTrue(osp.exists(self.cd(n, 'input/params.txt')))
+            self.assertFalse(osp.exists(self.cd(n, 'output/out.txt')))
+
+    def test_modes(self):
+        with open(self.pd('input/params.txt'), 'w') as f:
+            f.write('parent')
+        for mode in ['symlink', 'hardlink', 'auto']:
+            clone = self.project.clone(mode, mode=mode)
+            path = osp.join(clone.projectdir, 'input/params.txt')
+            self.assertEqual(osp.islink(path), mode == 'symlink')
+            self.assertEqual(os.stat(path).st_nlink > 1, mode == 'hardlink')
+            # writable without changing the parent
+            self.assertEqual(utils.break_link(path), mode != 'auto')
+            self.assertFalse(osp.islink(path))
+            with open(path, 'w') as f:
+                f.write(mode)
+            with open(self.pd('input/params.txt')) as f:
+                self.assertEqual(f.read(), 'parent')
+        with self.assertRaises(ValueError):
+            self.project.clone('unknown', mode='unknown')
+        # copying over links leaves the parent intact
+        for mode in ['symlink', 'hardlink']:
+            dest = osp.join(self.project.clone.resourcedir, 'over' + mode)
+            utils.copy_resources(self.pd('input'), dest, mode=mode)
+            utils.copy_resources(self.pd('input'), dest, overwrite=True)
+            self.assertFalse(osp.islink(osp.join(dest, 'params.txt')))
+            with open(self.pd('input/params.txt')) as f:
+                self.assertEqual(f.read(), 'parent')
+        path = self.pd('input/params.txt')
+        with self.assertRaises(shutil.SameFileError):
+            utils.copy_file(path, path)
+
+    def test_sync(self):
+        clone = self.project.clone('testclone')
+        unchanged = {'copied': [], 'linked': [], 'created': [], 'removed': []}
+        self.assertEqual(self.project.clone.sync('testclone'), unchanged)
+        # changes in parent
+        with open(self.pd('input/params.txt'), 'w') as f:
+            f.write('changed')
+        os.remove(self.pd('output/out.txt'))
+        os.mkdir(self.pd('new'))
+        open(self.pd('new/new.txt'), 'w').close()
+        # changes in clone
+        with open(self.cd('testclone/input/input.txt'), 'w') as f:
+            f.write('changed')
+        open(self.cd('testclone/output/model.out'), 'w').close()
+        changes = self.project.clone.sync('testclone')
+        self.assertEqual(sorted(changes['copied']),
+                         ['input/input.txt', 'input/params.txt',
+                          'new/new.txt'])
+        self.assertEqual(changes['created'], ['new'])
+        self.assertEqual(changes['removed'], ['output/out.txt'])
+        with open(self.cd('testclone/input/params.txt')) as f:
+            self.assertEqual(f.read(), 'changed')
+        self.assertTrue(osp.exists(self.cd('testclone/output/model.out')))
+        self.assertTrue(osp.islink(self.cd('testclone/mm')))
+        # the manifest is not cloned
+        clone.clone('testclone2')
+        self.assertEqual(clone.clone.sync('testclone2'), unchanged)
+        # batch, rules of the clones are kept
+        self.project.clone('ignoring', ignore=['input/*'])
+        open(self.pd('input/new.txt'), 'w').close()
+        changes = self.project.clone.sync_many(['testclone', 'ignoring'])
+        self.assertEqual(changes[0]['copied'], ['input/new.txt'])
+        self.assertEqual(changes[1], unchanged)
+
+    def test_pool(self):
+        pool = self.project.clone.pool(2, clone_setting=1)
+        self.assertEqual(self.project.clone.names(), ['pool000', 'pool001'])
+        clone = pool.checkout()
+        self.assertEqual(clone.clone_setting, 1)
+        self.assertEqual(pool.checkout().clonename, 'pool001')
+        with self.assertRaises(RuntimeError):
+            pool.checkout(timeout=0.1)
+        pool.checkin(clone)
+        with self.assertRaises(ValueError):
+            pool.checkin(clone)
+        pool.checkin(pool.project.clone['pool001'])
+        # concurrent use from threads and processes
+        with ThreadPoolExecutor(4) as threads:
+            names = list(threads.map(borrow_clone, [pool]*8, range(8)))
+        self.assertEqual(set(names), set(pool.names))
+        with ProcessPoolExecutor(3) as processes:
+            names = list(processes.map(borrow_clone, [pool]*6, range(6)))
+        self.assertEqual(set(names), set(pool.names))
+        # clones are reset to the parent
+        for n in pool.names:
+            self.assertFalse(osp.exists(self.cd(n, 'output/model.out')))
+            with open(self.cd(n, 'input/params.txt')) as f:
+                self.assertEqual(f.read(), '')
+
+    def test_map(self):
+        params = [{'settings': {'sleep': 0.01*i, 'fail': False}}
+                  for i in range(4)]
+        progress = []
+        results = self.project.clone.map(
+            map_function, params, processes=2,
+            progress=lambda d, t: progress.append((d, t)))
+        self.assertEqual([r[0] for r in results],
+                         ['map%04i' % i for i in range(4)])
+        self.assertEqual(len(set(r[1] for r in results)), 4)
+        self.assertEqual(progress, [(i, 4) for i in range(1, 5)])
+        # errors, timeouts and retries
+        params[1]['settings']['fail'] = True
+        params[2]['settings']['sleep'] = 10
+        with self.assertRaises(ValueError):
+            self.project.clone.map(map_function, params, timeout=0.5)
+        results = self.project.clone.map(map_function, params, timeout=0.5,
+                                         retries=1, errors='return')
+        self.assertIsInstance(results[1], ValueError)
+        self.assertIsInstance(results[2], TimeoutError)
+        self.assertEqual(results[3][0], 'map0003')
+
+    def test_cache(self):
+        cache = self.project.clone.loaded_clones
+        cache.clear()
+        clone = self.project.clone('testclone')
+        self.assertIs(self.project.clone['testclone'], clone)
+        info = self.project.clone.cache_info()
+        self.assertEqual((info.hits, info.currsize), (1, 1))
+        # projects with the same clone names
+        other = create_project('otherproject', TEST_SETTINGS)
+        try:
+            self.assertIsNot(other.clone('testclone'), clone)
+        finally:
+            shutil.rmtree('otherproject')
+        # size limit keeps weak references (only for this project)
+        project = mm.Project(self.projectdir, clone_cache_maxsize=1)
+        self.assertIs(project.clone.loaded_clones, cache)
+        self.assertEqual(cache.maxsize, 1)
+        self.assertEqual(other.clone.cache_info().maxsize, 128)
+        self.assertEqual(len(cache), 1)
+        self.assertIs(project.clone['testclone'], clone)
+        project.clone('testclone2')
+        info = project.clone.cache_info()
+        self.assertEqual(info.currsize, 1)
+        self.assertGreaterEqual(info.weakrefs, 2)
+        self.assertIs(self.project.clone['testclone'], clone)
+        # clones get no cache unless they load clones themselves
+        caches = type(project.clone).clone_caches
+        before = set(caches)
+        clones = [self.project.clone('cached%s' % i) for i in range(3)]
+        self.assertEqual(set(caches), before)
+        clones[0].clone('nested')
+        self.assertIn(clones[0].projectdir, caches)
+        clones[0].remove()
+        self.project.clone.remove_many('cached*', background=False)
+        self.assertEqual(set(caches), before)
+
+    def test_index(self):
+        with open(self.pd('input/params.txt'), 'w') as f:
+            f.write('0' * 100)
+        self.project.clone('testclone')
+        self.project.clone.many(['hardlinked', 'other'], mode='hardlink')
+        os.remove(self.project.clone.index.path)
+        # rebuilt from the directories
+        names = ['hardlinked', 'other', 'testclone']
+        self.assertEqual(self.project.clone.names(), names)
+        self.project.clone('hardlinked', fresh=True, mode='hardlink')
+        self.assertEqual(self.project.clone.names('*r*'), names[:2])
+        clones = self.project.clone.query(mode='hardlink', order_by='created')
+        self.assertEqual([c['name'] for c in clones], names[1::-1])
+        self.assertEqual(clones[0]['disk_usage'], 0)
+        copied = self.project.clone.query('testclone')[0]
+        self.assertGreaterEqual(copied['disk_usage'], 100)
+        self.assertEqual(clones[1]['settings_hash'],
+                         self.project.clone._settings_hash())
+        before = time.time()
+        self.project.clone['testclone'].remove()
+        self.project.clone.loaded_clones.clear()
+        self.project.clone['other']
+        self.assertEqual(self.project.clone.names(), names[:2])
+        used = self.project.clone.query(last_used_after=before)
+        self.assertEqual([c['name'] for c in used], ['other'])
+        # loaded clones update last_used every last_used_interval seconds
+        before = time.time()
+        self.project.clone['other']
+        self.assertEqual(self.project.clone.query(last_used_after=before), [])
+        self.project.clone.last_used_interval = 0
+        self.project.clone['other']
+        used = self.project.clone.query(last_used_after=before)
+        self.assertEqual([c['name'] for c in used], ['other'])
+        with self.assertRaises(KeyError):
+            self.project.clone.query(unknown=1)
+        # indexed from the directories before the first new clone
+        os.remove(self.project.clone.index.path)
+        self.project.clone('new')
+        self.assertEqual(self.project.clone.names(),
+                         ['hardlinked', 'new', 'other'])
+        # deleted directories are dropped
+        shutil.rmtree(os.path.join(self.project.clone_dir, 'other'))
+        self.assertEqual(self.project.clone.names(), ['hardlinked', 'new'])
+        self.assertEqual(len(self.project.clone.query()), 2)
+
+    def test_resource_plan(self):
+        os.makedirs(self.pd('output/run1'))
+        open(self.pd('output/run1/out.txt'), 'w').close()
+        plan = utils.resource_plan(self.projectdir, ['output/*/*', 'mm'],
+                                   ['*params*'])
+        actions = {p: a for a, p, _ in plan}
+        self.assertEqual(actions['output/run1'], 'mkdir')
+        self.assertNotIn('output/run1/out.txt', actions)
+        self.assertNotIn('mm', actions)
+        self.assertEqual(actions['input/params.txt'], 'link')
+        self.assertEqual(actions['sym.link'], 'link')
+        self.assertEqual(actions['output/out.txt'], 'copy')
+        # directories before their content
+        paths = [p for _, p, _ in plan]
+        self.assertLess(paths.index('output'), paths.index('output/run1'))
+        matcher = utils.PathMatcher(['output/*/*', '*.txt', 'mm'])
+        self.assertEqual(matcher.subtree('input').patterns, ('*.txt',))
+        self.assertEqual(matcher.subtree('output').patterns,
+                         ('output/*/*', '*.txt'))
+
+    def test_copy_workers(self):
+        with open(self.pd('input/large.bin'), 'wb') as f:
+            f.write(os.urandom(2**20))
+        os.chmod(self.pd('input/large.bin'), 0o700)
+        stats = utils.copy_resources(self.projectdir, self.cd('copy'),
+                                     ignorepatterns=['mm'], workers=4)
+        self.assertEqual(stats.files, 5)
+        self.assertGreater(stats.bytes, 2**20)
+        self.assertGreater(stats.throughput, 0)
+        with open(self.pd('input/large.bin'), 'rb') as f:
+            with open(self.cd('copy/input/large.bin'), 'rb') as fc:
+                self.assertEqual(f.read(), fc.read())
+        self.assertEqual(os.stat(self.cd('copy/input/large.bin')).st_mode,
+                         os.stat(self.pd('input/large.bin')).st_mode)
+        clone = self.project.clone('testclone', copy_workers=4)
+        self.assertTrue(osp.exists(osp.join(clone.projectdir,
+                                            'input/large.bin')))
+
     def test_remove(self):
         clone = self.project.clone('testclone')
         self.assertTrue(osp.isdir(self.cd('testclone')))
         clone.remove()
         self.assertFalse(osp.exists(self.cd('testclone')))
+        # in the background
+        clone = self.project.clone('testclone')
+        future = clone.remove(background=True)
+        self.assertFalse(osp.exists(self.cd('testclone')))
+        future.result()
+        self.assertEqual(os.listdir(self.cd('.trash')), [])
+        self.project.clone('testclone')
+        clone = self.project.clone('testclone', fresh=True)
+        self.assertTrue(osp.exists(self.cd('testclone/input/params.txt')))
+        # failed background removals of fresh clones warn
+        failed = Future()
+        failed.add_done_callback(mm.plugins.clones._warn_failed_removal)
+        with self.assertWarns(UserWarning):
+            failed.set_exception(OSError('busy'))
+        self.project.clone.many(['a1', 'a2', 'b1'])
+        self.assertEqual(self.project.clone.remove_many('a*'), ['a1', 'a2'])
+        for f in self.project.clone.removals:
+            f.result()
+        self.assertEqual(self.project.clone.names(), ['b1', 'testclone'])
+        # stale index entries are removed as well
+        self.project.clone.index.add('stale')
+        names = self.project.clone.remove_many('[bs]*', background=False)
+        self.assertEqual(names, ['b1'])
+        self.assertEqual(self.project.clone.index.names(), ['testclone'])
+        self.project.clone.empty_trash()
+        self.assertFalse(osp.exists(self.cd('.trash')))
 
 
 if __name__ == '__main__':
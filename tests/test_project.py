@@ -3,7 +3,9 @@ import unittest
 import os
 import shutil
 import subprocess
+import tracemalloc
 
+import pickle
 import cProfile, pstats
 
 import modelmanager as mm
@@ -174,21 +176,188 @@ class Settings(ProjectTestCase):
         func = self.settings.functions['testplugin.test_method']
         self.assertEqual(func.positional_arguments, ['testarg'])
 
+    def test_instance_properties(self):
+        other = mm.Project(self.projectdir)
+        self.project.settings(instprop=property(lambda p: 1))
+        other.settings(instprop=property(lambda p: 2))
+        self.assertIsInstance(mm.Project.__dict__['instprop'],
+                              mm.settings.PropertyDispatcher)
+        self.assertEqual((self.project.instprop, other.instprop), (1, 2))
+        # properties of other projects are undefined settings
+        self.project.settings(onlyprop=property(lambda p: 1))
+        self.assertEqual(self.project.onlyprop, 1)
+        with self.assertRaises(mm.settings.SettingsUndefinedError):
+            other.onlyprop
+        # setter
+        prop = property(lambda p: p._value,
+                        lambda p, v: setattr(p, '_value', v))
+        self.project.settings(setprop=prop)
+        self.project.setprop = 3
+        self.assertEqual(self.project.setprop, 3)
+        # variables replace properties
+        self.project.settings(setprop=4)
+        self.assertEqual(self.project.setprop, 4)
+        self.assertNotIn('setprop', self.settings.properties)
+
+    def test_profile(self):
+        self.assertEqual(self.settings.profile.phases, [])
+        project = mm.Project(self.projectdir, _profile=True)
+        phases = {p['phase']: p for p in project.settings.profile.phases}
+        for n in ['find settings file', 'load settings file',
+                  'instantiate testplugin', 'register_plugin testplugin']:
+            self.assertIn(n, phases)
+            self.assertGreaterEqual(phases[n]['seconds'], 0)
+            self.assertGreaterEqual(phases[n]['peak_memory'], 0)
+        self.assertIn('instantiate testplugin',
+                      project.settings.profile.report())
+        # memory is only traced during phases
+        plugin = type('testplugin2', (), {'__init__': lambda s, p: None})
+        project.settings(testplugin2=plugin)
+        self.assertIn('register_plugin testplugin2',
+                      [p['phase'] for p in project.settings.profile.phases])
+        self.assertFalse(tracemalloc.is_tracing())
+        # profile is a normal setting
+        self.assertEqual(mm.Project(self.projectdir, profile=1).profile, 1)
+
+    def test_resourcedir_marker(self):
+        marker = os.path.join(self.projectdir, mm.settings.RESOURCEDIR_MARKER)
+        with open(marker) as f:
+            self.assertEqual(f.read().strip(), 'mm')
+        # recorded resourcedir is found first
+        os.makedirs(os.path.join(self.projectdir, 'a', 'mm'))
+        shutil.copy(self.settings.file, os.path.join(self.projectdir, 'a'))
+        found = mm.settings.find_settings_file(self.projectdir)
+        self.assertEqual(found, self.settings.file)
+        # fall back to search and record
+        os.remove(marker)
+        os.remove(os.path.join(self.projectdir, 'a', 'settings.py'))
+        self.assertEqual(mm.Project(self.projectdir).settings.file,
+                         self.settings.file)
+        self.assertTrue(os.path.exists(marker))
+
+    def test_pickle(self):
+        self.project.settings(test_session_variable=2)
+        project = pickle.loads(pickle.dumps(self.project))
+        self.assertIsNot(project, self.project)
+        self.assertEqual(project.projectdir, self.projectdir)
+        self.assertEqual(project.test_session_variable, 2)
+        self.assertEqual(project.testplugin.test_method(1, setting=1), 2)
+
+    def test_lazy_function_info(self):
+        func = self.settings.functions['testplugin.test_method']
+        self.assertNotIn('code', func.__dict__)
+        self.assertIn('def test_method', func.code)
+        self.assertEqual(func.firstcodeline, 22)
+        doc = mm.settings.FunctionInfo(mm.settings.load_settings).__doc__
+        self.assertEqual(doc, 'Load settings from a module or a module file.')
+        # plugin classes are crawled once and shared with other projects
+        project = mm.Project(self.projectdir)
+        self.assertIs(project.settings.functions['testplugin.test_method'],
+                      func)
+
+    def test_settings_file_cache(self):
+        module = self.settings.module
+        self.settings.load()
+        self.assertIs(self.settings.module, module)
+        self.assertIs(mm.Project(self.projectdir).settings.module, module)
+        # changed file is executed again
+        with open(self.settings.file, 'a') as f:
+            f.write('\ntest_appended_variable = 789\n')
+        self.settings.load()
+        self.assertIsNot(self.settings.module, module)
+        self.assertEqual(self.project.test_appended_variable, 789)
+        # mutable settings are not shared between projects
+        with open(self.settings.file, 'a') as f:
+            f.write('\ntest_mutable = [1]\n')
+        project = mm.Project(self.projectdir)
+        project.test_mutable.append(2)
+        self.assertEqual(mm.Project(self.projectdir).test_mutable, [1])
+
+    def test_lazy_plugins(self):
+        project = mm.Project(self.projectdir, lazy_plugins=True)
+        proxy = project.__dict__['testplugin']
+        self.assertIsInstance(proxy, mm.settings.LazyPlugin)
+        self.assertEqual(project.testplugin.test_project_variable, 123)
+        self.assertNotIsInstance(project.__dict__['testplugin'],
+                                 mm.settings.LazyPlugin)
+        self.assertEqual(proxy.test_method(1, setting=1), 2)
+        self.assertIn('testplugin.test_method', project.settings.functions)
+
+    def test_cachedpropertyplugin(self):
+        path = os.path.join(self.projectdir, 'cached.txt')
+        with open(path, 'w') as f:
+            f.write('1')
+
+        class cached(object):
+            def __init__(self, project):
+                self.path = path
+                with open(path) as f:
+                    self.value = f.read()
+
+            def write(self, value):
+                with open(self.path, 'w') as f:
+                    f.write(value)
+        other = mm.Project(self.projectdir)
+        for p in [self.project, other]:
+            p.settings(cached=mm.utils.cachedpropertyplugin(cached))
+        instance = self.project.cached
+        self.assertIs(self.project.cached, instance)
+        self.assertIsNot(other.cached, instance)
+        # write invalidates
+        instance.write('22')
+        self.assertEqual(self.project.cached.value, '22')
+        # file changes invalidate
+        instance = self.project.cached
+        with open(path, 'w') as f:
+            f.write('333')
+        self.assertEqual(self.project.cached.value, '333')
+        # settings changes invalidate
+        instance = self.project.cached
+        self.settings(test_variable=1)
+        self.assertIsNot(self.project.cached, instance)
+        # memory budget evicts least recently used
+        self.settings(other=mm.utils.cachedpropertyplugin(cached),
+                      plugin_cache_maxmemory=0)
+        self.project.cached, self.project.other
+        self.assertEqual(len(self.settings.plugin_cache), 1)
+
     def test_parse_settings(self):
         # simple function
         self.assertEqual(self.project.test_function(), 2)
         self.project.settings(test_function_d=0)
         self.assertEqual(self.project.test_function(), 1)
+        # instance attributes are read on each call
+        self.project.test_function_d = 5
+        self.assertEqual(self.project.test_function(), 6)
+        del self.project.test_function_d
+        self.assertEqual(self.project.test_function(), 2)
+        self.project.test_function_d = 9
+        self.assertEqual(self.project.test_function(), 10)
         # plugin.method
         self.assertEqual(self.project.testplugin.test_method(1, setting=1), 2)
         self.project.settings(testplugin_test_method_setting=1)
         self.assertEqual(self.project.testplugin.test_method(1), 2)
+        # resolved settings are cached until settings change
+        version = self.settings.version
+        self.project.settings(testplugin_test_method_setting=2)
+        self.assertGreater(self.settings.version, version)
+        self.assertEqual(self.project.testplugin.test_method(1), 3)
+        plugin = self.project.testplugin
+        args = mm.settings.parsed_arguments(type(plugin).test_method, plugin)
+        self.assertEqual(args, {'setting': 2})
+        # properties are always evaluated
+        self.project.settings(test_function_d=property(lambda p: p.d))
+        for d in range(3):
+            self.project.d = d
+            self.assertEqual(self.project.test_function(), d + 1)
 
 
 class CommandlineInterface(ProjectTestCase):
 
-    def call(self, *argslist):
-        argslist = ['modelmanager', '-p', self.projectdir]+list(argslist)
+    def call(self, *argslist, **kwargs):
+        options = kwargs.get('options', [])
+        argslist = (['modelmanager'] + options + ['-p', self.projectdir] +
+                    list(argslist))
         proc = subprocess.Popen(argslist, stdout=subprocess.PIPE,
                                 stderr=subprocess.PIPE)
         proc.wait()
@@ -216,6 +385,16 @@ class CommandlineInterface(ProjectTestCase):
         self.assertEqual(out[0], "bar")
         self.assertEqual(err[0], ">>> result.resultresult.plot()")
 
+    def test_profile(self):
+        out, err = self.call('--profile', 'test_function')
+        self.assertEqual(out[0], '2')
+        self.assertTrue(err[0].startswith('Phase'))
+        self.assertTrue(any('instantiate testplugin' in l for l in err))
+        # before the projectdir
+        out, err = self.call('test_function', options=['--profile'])
+        self.assertEqual(out[0], '2')
+        self.assertTrue(err[0].startswith('Phase'))
+
     def test_flag(self):
         # short
         out, err1 = self.call('test_function', '-e')
@@ -1,9 +1,15 @@
 """Test module for the Templates plugin."""
 import unittest
 import os
+import threading
+import importlib
 import cProfile, pstats
 
 import test_project
+from modelmanager.plugins.templates import template_info, Template
+
+# the templates plugin class shadows its module in modelmanager.plugins
+templates_module = importlib.import_module('modelmanager.plugins.templates')
 
 test_project.TEST_SETTINGS += """
 from modelmanager.plugins import templates
@@ -67,6 +73,52 @@ class TestTemplates(test_project.ProjectTestCase):
         param = self.templates['param']
         self.assertRaises(KeyError, param.write_values, unknown=1)
 
+    def test_write_linked(self):
+        path = os.path.join(self.projectdir, 'input/test_param.txt')
+        linked = os.path.join(self.projectdir, 'linked_param.txt')
+        os.rename(path, linked)
+        os.symlink(os.path.relpath(linked, os.path.dirname(path)), path)
+        self.templates(n=100)
+        self.assertFalse(os.path.islink(path))
+        self.assertEqual(self.templates('n', templates='param'), 100)
+        original = TEST_TEMPLATES['input/test_param.txt'][1]
+        with open(linked) as f:
+            self.assertEqual(f.read(), original)
+
+    def test_template_cache(self):
+        param = self.templates['param']
+        info = template_info(param.templatepath)
+        self.assertIs(template_info(param.templatepath), info)
+        self.assertEqual(param.read_values('n'), 1)
+        with open(param.templatepath, 'w') as f:
+            f.write("Changed parameters\n{n:d} {d:f}")
+        with open(param.filepath, 'w') as f:
+            f.write("Changed parameters\n2 1.1")
+        self.assertIsNot(template_info(param.templatepath), info)
+        self.assertEqual(param.read_values('n'), 2)
+
+    def test_field_index(self):
+        index = self.templates.field_index()
+        self.assertEqual(index['n'], ['input/test_config.pr',
+                                      'input/test_param.txt'])
+        self.assertEqual(index['test'], ['input/test_config.pr'])
+        self.assertTrue(os.path.exists(self.templates.index_path))
+        # only templates with the values are parsed
+        with open(os.path.join(self.projectdir, 'input/test_param.txt'),
+                  'a') as f:
+            f.write('unparsable')
+        self.templates(test='ABC')
+        self.assertEqual(self.templates('test'), 'ABC')
+        # new templates are indexed
+        with open(os.path.join(self.templates.resourcedir, 'new.txt'),
+                  'w') as f:
+            f.write('new {new:d}')
+        with open(os.path.join(self.projectdir, 'new.txt'), 'w') as f:
+            f.write('new 1')
+        self.assertEqual(self.templates('new'), 1)
+        self.assertEqual(self.project.templates.field_index()['new'],
+                         ['new.txt'])
+
     def test_subset(self):
         self.assertEqual(self.templates('n', templates='config'), 1)
         self.templates(n=2, templates=['config'])
@@ -81,6 +133,128 @@ class TestTemplates(test_project.ProjectTestCase):
         self.project.params['n'] = 3
         self.assertEqual(self.templates('n', templates='param'), 3)
 
+    def test_spans(self):
+        param = self.templates['param']
+        path = param.filepath
+        spans = param.spans
+        self.assertEqual(spans.text[slice(*spans.spans['d'])], '1.1')
+        # values are patched keeping the layout of the file
+        param.write_values(n=2)
+        self.assertIs(param.spans, spans)
+        param.write_values(d=12.5)
+        with open(path) as f:
+            self.assertEqual(f.read(), "Test parameters\n 2     12.500000 ")
+        self.assertEqual(param.read_values(), {'n': 2, 'd': 12.5})
+        self.templates(n=34, test='ABCDE')
+        with open(path) as f:
+            self.assertEqual(f.read(), "Test parameters\n 34     12.500000 ")
+        self.assertEqual(self.templates('test'), 'ABCDE')
+        # templates() and batches keep the parsed spans
+        config = self.templates['config']
+        spans = param.spans, config.spans
+        self.templates(n=3)
+        self.templates(test='XYZ')
+        self.assertIs(param.spans, spans[0])
+        self.assertIs(config.spans, spans[1])
+        self.assertEqual(self.templates('n', 'test'), (3, 'XYZ'))
+        # external changes are parsed again
+        with open(path, 'w') as f:
+            f.write("Test parameters\n5 0.5\n")
+        self.assertEqual(param.read_values(), {'n': 5, 'd': 0.5})
+        # least recently parsed files are evicted beyond the memory limit
+        cache = templates_module._spans_cache
+        maxmemory = templates_module.SPANS_CACHE_MAXMEMORY
+        try:
+            templates_module.SPANS_CACHE_MAXMEMORY = len(param.spans.text)
+            cache.pop(config.filepath)
+            config.read_values()
+            self.assertIn(config.filepath, cache)
+            self.assertNotIn(path, cache)
+        finally:
+            templates_module.SPANS_CACHE_MAXMEMORY = maxmemory
+        # and dropped for removed directories
+        templates_module._drop_spans(os.path.dirname(config.filepath))
+        self.assertNotIn(config.filepath, cache)
+
+    def test_spans_crlf(self):
+        tpath = os.path.join(self.templates.resourcedir, 'crlf.txt')
+        with open(tpath, 'w') as f:
+            f.write("Header line\n{a:d} {b:d}\n{c:d}")
+        path = os.path.join(self.projectdir, 'crlf.txt')
+        with open(path, 'wb') as f:
+            f.write(b"Header line\r\n1 2\r\n3\r\n")
+        tmplt = Template(tpath, path)
+        tmplt.write_values(c=7)
+        tmplt.write_values(a=10)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b"Header line\r\n10 2\r\n7\r\n")
+        self.assertEqual(tmplt.read_values(), {'a': 10, 'b': 2, 'c': 7})
+
+    def test_batch_threads(self):
+        def set_values(name, values):
+            for v in values:
+                self.templates(**{name: v})
+        # batches are not shared between threads
+        with self.templates.batch():
+            self.templates(n=2)
+            thread = threading.Thread(target=set_values, args=('d', [9.5]))
+            thread.start()
+            thread.join()
+            self.assertEqual(self.templates['param'].read_values('d'), 9.5)
+        self.assertEqual(self.templates('n', 'd'), (2, 9.5))
+        # concurrent changes of the same files are not lost
+        threads = [threading.Thread(target=set_values, args=a) for a in
+                   [('n', range(20)), ('test', ['T%i' % i for i in range(20)]),
+                    ('d', [i + 0.5 for i in range(20)])]]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(self.templates('n', 'test', 'd'), (19, 'T19', 19.5))
+
+    def test_render(self):
+        import pandas as pd
+        parameters = pd.DataFrame({'n': [1, 2, 3], 'd': [0.5, 1.5, 2.5],
+                                   'test': ['A', 'B', 'C']})
+        dests = [os.path.join(self.projectdir, 'set%i' % i) for i in range(3)]
+        written = self.templates.render(parameters, dests, workers=2)
+        self.assertEqual(len(written), 3)
+        for (_, row), d, paths in zip(parameters.iterrows(), dests, written):
+            self.assertEqual(len(paths), 2)
+            for p in TEST_TEMPLATES:
+                self.assertIn(os.path.join(d, p), paths)
+                tmplt = Template(os.path.join(self.templates.resourcedir, p),
+                                 os.path.join(d, p))
+                for k, v in tmplt.read_values().items():
+                    self.assertEqual(v, row[k] if k in row else
+                                     self.templates(k, templates=p))
+        # the project itself is unchanged
+        self.assertEqual(self.templates('n', 'test'), (1, 'XYZ'))
+        self.assertRaises(KeyError, self.templates.render, [{'unknown': 1}],
+                          dests[:1])
+
+    def test_batch(self):
+        path = os.path.join(self.projectdir, 'input/test_config.pr')
+        with self.templates.batch():
+            self.templates(n=5, test='ABC')
+            self.project.params['d'] = 2.5
+            # staged values are read back but not written yet
+            self.assertEqual(self.templates('n'), 5)
+            self.assertEqual(self.project.params['n'], 5)
+            with open(path) as f:
+                self.assertIn('XYZ', f.read())
+        self.assertEqual(self.templates('n', 'd', 'test'), (5, 2.5, 'ABC'))
+        # unknown values roll back the whole batch
+        with self.assertRaises(KeyError):
+            with self.templates.batch():
+                self.templates(n=6)
+                self.templates(unknown=1)
+        self.assertRaises(KeyError, self.templates, n=7, unknown=1)
+        self.assertEqual(self.templates('n', templates='param'), 5)
+        self.assertEqual(self.templates('n', templates='config'), 5)
+        self.assertEqual(sorted(os.listdir(os.path.dirname(path))),
+                         ['test_config.pr', 'test_param.txt'])
+
 
 if __name__ == '__main__':
     cProfile.run('unittest.main()', 'pstats')